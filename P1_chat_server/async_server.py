@@ -0,0 +1,18 @@
+import argparse
+
+from src.async_server import AsyncServer
+from src.logs import setup_logging
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--log", choices=["sync", "queued"], default="sync")
+    parser.add_argument("--log-sample", type=int, default=1, help="log one out of every N messages")
+    args = parser.parse_args()
+
+    setup_logging(queued=args.log == "queued", sample=args.log_sample)
+
+    s = AsyncServer(args.host, args.port)
+
+    s.loop()
@@ -0,0 +1,193 @@
+"""Load generator and fan-out latency benchmark for the chat server."""
+import argparse
+import random
+import resource
+import selectors
+import socket
+import subprocess
+import sys
+import time
+
+from src.protocol import BINARY, ZLIB, CDProto, CDProtoStream, TextMessage
+
+
+def start_server(args):
+    """Launches the chat server in a child process and waits until it accepts connections."""
+
+    cmd = [sys.executable, "server.py", "--port", str(args.port), "--workers", str(args.workers)]
+    if args.engine == "async":
+        cmd = [sys.executable, "-c", f"from src.async_server import AsyncServer; AsyncServer(port={args.port}).loop()"]
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    for _ in range(50):
+        try:
+            socket.create_connection(("localhost", args.port)).close()
+            return proc
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+
+    proc.kill()
+    sys.exit("server did not start")
+
+
+def server_rss(proc) -> int:
+    """RSS (in KiB) of the server process and its workers."""
+
+    pids = [proc.pid]
+    try:
+        with open(f"/proc/{proc.pid}/task/{proc.pid}/children") as f:
+            pids += [int(pid) for pid in f.read().split()]
+    except OSError:
+        pass
+
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Bench:
+    """Simulated clients driven from a single selector loop."""
+
+    def __init__(self, args):
+        self.args = args
+        self.sel = selectors.DefaultSelector()
+        self.clients = []           # (socket, stream, channel)
+        self.latencies = []         # segundos entre o envio e a receção de cada cópia
+        self.received = 0
+        self.sent = 0
+        self.bytes_in = 0           # bytes recebidos pelos clientes (tráfego de saída do servidor)
+        line = "    return self.channels.get(channel, ())\n"
+        self.padding = line * round(args.size / len(line))      # texto tipo código colado
+
+    def connect(self):
+        """Connects, registers and joins every simulated client."""
+
+        caps = [BINARY] if self.args.binary else []
+        if self.args.zlib:
+            caps.append(ZLIB)
+        channels = max(1, self.args.clients // self.args.channel_size)
+
+        for i in range(self.args.clients):
+            sock = socket.create_connection(("localhost", self.args.port))
+            channel = f"#bench{i % channels}"
+
+            sock.sendall(CDProto.encode_msg(CDProto.register(f"bot{i}", caps)))
+            sock.sendall(CDProto.encode_msg(CDProto.join(channel), self.args.binary))
+            sock.setblocking(False)
+
+            stream = CDProtoStream(sock)
+            stream.binary = self.args.binary
+            self.sel.register(sock, selectors.EVENT_READ, stream)
+            self.clients.append((sock, stream, channel))
+
+    def send_one(self):
+        """Sends a timestamped message from a random client to its channel."""
+
+        sock, _, channel = random.choice(self.clients)
+        msg = CDProto.message(f"{self.padding}{time.monotonic_ns()}", channel)
+        try:
+            sock.send(CDProto.encode_msg(msg, self.args.binary))
+            self.sent += 1
+        except BlockingIOError:
+            pass
+
+    def drain(self, timeout):
+        """Reads every available frame and records its fan-out latency."""
+
+        for key, mask in self.sel.select(timeout):
+            stream = key.data
+            self.bytes_in += stream.fill()
+            msg = CDProto.recv_msg(stream)
+            now = time.monotonic_ns()
+            while msg:
+                sent_at = msg.message.split()[-1] if type(msg) is TextMessage else ""
+                if sent_at.isdigit():
+                    self.latencies.append((now - int(sent_at)) / 1e9)
+                    self.received += 1
+                msg = CDProto.recv_msg(stream)
+
+    def run(self):
+        """Sends at the configured rate for the configured duration."""
+
+        time.sleep(0.5)         # dar tempo ao servidor para processar os joins
+        self.drain(0)
+        self.latencies.clear()
+        self.received = 0
+        self.bytes_in = 0
+
+        interval = 1 / self.args.rate
+        start = time.monotonic()
+        next_send = start
+        while time.monotonic() - start < self.args.duration:
+            now = time.monotonic()
+            while next_send <= now:
+                self.send_one()
+                next_send += interval
+            self.drain(max(0, next_send - time.monotonic()))
+
+        end = time.monotonic() + 1          # recolher as mensagens que ainda estão a caminho
+        while time.monotonic() < end:
+            self.drain(0.05)
+
+        return time.monotonic() - start - 1
+
+    def close(self):
+        for sock, _, _ in self.clients:
+            self.sel.unregister(sock)
+            sock.close()
+
+
+def main(args):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))    # milhares de sockets abertos
+
+    proc = start_server(args)
+    bench = Bench(args)
+    try:
+        bench.connect()
+        elapsed = bench.run()
+        rss = server_rss(proc)
+    finally:
+        bench.close()
+        proc.terminate()
+        proc.wait()
+
+    lat = sorted(bench.latencies)
+    print(f"clients: {args.clients}  channel size: {args.channel_size}  rate: {args.rate} msg/s  "
+          f"engine: {args.engine}  workers: {args.workers}  binary: {args.binary}  zlib: {args.zlib}  size: {args.size}")
+    print(f"sent: {bench.sent}  delivered: {bench.received}  ({bench.received / elapsed:.0f} msgs/sec delivered)")
+    print(f"server outbound: {bench.bytes_in / elapsed / 1024:.0f} KiB/s")
+    print(f"fan-out latency ms  p50: {percentile(lat, 0.5) * 1000:.2f}  "
+          f"p99: {percentile(lat, 0.99) * 1000:.2f}  p999: {percentile(lat, 0.999) * 1000:.2f}")
+    print(f"server RSS: {rss / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--channel-size", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=200, help="messages sent per second")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--engine", choices=["selector", "async"], default="selector")
+    parser.add_argument("--binary", default=False, action="store_true")
+    parser.add_argument("--zlib", default=False, action="store_true", help="negotiate zlib compression")
+    parser.add_argument("--size", type=int, default=0, help="bytes of (code like) text added to each message")
+    args = parser.parse_args()
+
+    main(args)
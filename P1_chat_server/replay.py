@@ -0,0 +1,173 @@
+"""Replays a recorded chat server workload and reports latency and throughput."""
+import argparse
+import json
+import selectors
+import socket
+import time
+
+from bench import percentile, start_server
+from src.protocol import BINARY, CDProto, CDProtoBadFormat, CDProtoStream, TextMessage
+from src.recorder import CLOSE, CONNECT, DATA, read_events
+
+
+class Replayer:
+    """Opens the recorded connections and sends what they sent, at the recorded pace.
+
+    The bytes of each connection are sent exactly as they were received by the
+    recording server; they are also decoded here, to know which broadcast every
+    message will produce and measure its fan-out latency.
+    """
+
+    def __init__(self, path: str, host: str = "localhost", port: int = 8080, speed: float = 1):
+        """speed: 1 replays in real time, 10 ten times faster, and so on."""
+
+        self.path = path
+        self.address = (host, port)
+        self.speed = speed
+        self.sel = selectors.DefaultSelector()
+        self.conns = {}         # id da ligação gravada : socket
+        self.sent = {}          # id : CDProtoStream com os dados enviados (só para os descodificar)
+        self.users = {}         # id : username registado
+        self.pending = {}       # broadcast esperado : instante do envio (mensagens iguais contam a partir da última)
+        self.latencies = []
+        self.frames = 0
+        self.received = 0
+
+    def apply(self, conn_id: int, kind: int, data: bytes):
+        if kind == CONNECT:
+            sock = socket.create_connection(self.address)
+            stream = CDProtoStream(sock)
+            self.conns[conn_id] = sock
+            self.sent[conn_id] = CDProtoStream(None)
+            self.sel.register(sock, selectors.EVENT_READ, stream)
+
+        elif kind == DATA and conn_id in self.conns:
+            self.conns[conn_id].sendall(data)
+            self.decode_sent(conn_id, data)
+
+        elif kind == CLOSE and conn_id in self.conns:
+            sock = self.conns.pop(conn_id)
+            if sock in self.sel.get_map():      # pode já ter sido fechada pelo servidor
+                self.sel.unregister(sock)
+            sock.close()
+
+    def decode_sent(self, conn_id: int, data: bytes):
+        """Follows the frames sent by conn_id (register, binary switch, messages)."""
+
+        stream = self.sent[conn_id]
+        stream.feed(data)
+        now = time.monotonic()
+        try:
+            msg = CDProto.recv_msg(stream)
+            while msg:
+                self.frames += 1
+                if msg.command == "register":
+                    self.users[conn_id] = msg.user
+                    if BINARY in msg.caps:      # as respostas do servidor também passam a binário
+                        stream.binary = True
+                        self.sel.get_key(self.conns[conn_id]).data.binary = True
+
+                elif type(msg) is TextMessage:
+                    self.pending[f'<<{msg.channel}>> [{self.users.get(conn_id)}]: {msg.message}'] = now
+
+                msg = CDProto.recv_msg(stream)
+        except CDProtoBadFormat:
+            stream.clear()
+
+    def drain(self, timeout):
+        """Reads every available frame and records its fan-out latency."""
+
+        for key, mask in self.sel.select(timeout):
+            stream = key.data
+            stream.fill()
+            now = time.monotonic()
+            msg = CDProto.recv_msg(stream)
+            while msg:
+                if type(msg) is TextMessage:
+                    self.received += 1
+                    sent_at = self.pending.get(msg.message)
+                    if sent_at is not None:
+                        self.latencies.append(now - sent_at)
+                msg = CDProto.recv_msg(stream)
+
+            if stream.closed:
+                self.sel.unregister(key.fileobj)
+
+    def run(self) -> dict:
+        """Replays the whole recording and returns the summary of the run."""
+
+        start = time.monotonic()
+        for at, conn_id, kind, data in read_events(self.path):
+            due = start + at / self.speed
+            wait = due - time.monotonic()
+            while wait > 0:
+                self.drain(wait)
+                wait = due - time.monotonic()
+            self.apply(conn_id, kind, data)
+
+        elapsed = time.monotonic() - start
+        end = time.monotonic() + 1          # recolher as mensagens que ainda estão a caminho
+        while time.monotonic() < end:
+            self.drain(0.05)
+
+        for sock in self.conns.values():
+            sock.close()
+
+        lat = sorted(self.latencies)
+        return {
+            "duration": elapsed,
+            "frames_sent": self.frames,
+            "delivered": self.received,
+            "frames_per_sec": self.frames / elapsed if elapsed else 0,
+            "delivered_per_sec": self.received / elapsed if elapsed else 0,
+            "p50_ms": percentile(lat, 0.5) * 1000,
+            "p99_ms": percentile(lat, 0.99) * 1000,
+            "p999_ms": percentile(lat, 0.999) * 1000,
+        }
+
+
+def report(summary: dict, baseline: dict = None):
+    for name, value in summary.items():
+        line = f"{name:>18}: {value:12.2f}"
+        if baseline and baseline.get(name):
+            change = (value - baseline[name]) / baseline[name] * 100
+            line += f"   (baseline {baseline[name]:.2f}, {change:+.1f}%)"
+        print(line)
+
+
+def main(args):
+    proc = None if args.attach else start_server(args)
+    try:
+        summary = Replayer(args.recording, args.host, args.port, args.speed).run()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"recording: {args.recording}  speed: {args.speed}x")
+    report(summary, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording", help="file written by server.py --record")
+    parser.add_argument("--speed", type=float, default=1, help="replay speed (2 = twice as fast)")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--attach", default=False, action="store_true", help="use a server that is already running")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--engine", choices=["selector", "async"], default="selector")
+    parser.add_argument("--save", default=None, help="write the summary of the run to this json file")
+    parser.add_argument("--baseline", default=None, help="summary of a previous run to compare with")
+    args = parser.parse_args()
+
+    main(args)
@@ -1,6 +1,48 @@
+import argparse
+import sys
+
+from src.logs import setup_logging
 from src.server import Server
+from src.workers import run_workers
 
 if __name__ == "__main__":
-    s = Server()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--history", type=int, default=50)
+    parser.add_argument("--idle-timeout", type=float, default=60, help="seconds before an idle connection is pinged")
+    parser.add_argument("--rate", type=float, default=None, help="frames per second allowed per client")
+    parser.add_argument("--peers", default="", help="host:port of the other federated servers, comma separated (single process only)")
+    parser.add_argument("--peer-secret", default=None, help="secret shared by the federated servers")
+    parser.add_argument("--chanlog-dir", default=None, help="directory of the durable channel logs (single process only)")
+    parser.add_argument("--record", default=None, help="record the traffic received from clients to this file")
+    parser.add_argument("--admin-port", type=int, default=None, help="local port serving the metrics as json (worker i uses port + i)")
+    parser.add_argument("--log", choices=["sync", "queued"], default="sync")
+    parser.add_argument("--log-sample", type=int, default=1, help="log one out of every N messages")
+    args = parser.parse_args()
+
+    log_options = {"queued": args.log == "queued", "sample": args.log_sample}
+
+    if args.workers > 1 and args.chanlog_dir:
+        parser.error("--chanlog-dir needs a single process (the offsets of a channel are per server)")
+    if args.workers > 1 and args.record:
+        parser.error("--record needs a single process")
+    if args.workers > 1 and args.peers:
+        parser.error("--peers needs a single process (the peers dial one server, not each worker)")
+
+    if args.workers > 1:
+        sys.exit(run_workers(args.workers, args.host, args.port, log_options, history=args.history,
+                             idle_timeout=args.idle_timeout, rate=args.rate, admin_port=args.admin_port))
+    else:
+        setup_logging(**log_options)
+        peers = [peer for peer in args.peers.split(",") if peer]
+        s = Server(args.host, args.port, history=args.history, peers=peers, idle_timeout=args.idle_timeout,
+                   rate=args.rate, chanlog_dir=args.chanlog_dir, record=args.record,
+                   admin_port=args.admin_port, peer_secret=args.peer_secret)
 
-    s.loop()
+        try:
+            s.loop()
+        finally:
+            if s.recorder is not None:
+                s.recorder.flush(force=True)
@@ -0,0 +1,171 @@
+"""CD Chat server program (asyncio engine)."""
+import asyncio
+import logging
+
+from .protocol import BINARY, MAX_FRAME, ZLIB, CDProto, CDProtoBadFormat
+
+logging.basicConfig(filename="server.log", level=logging.DEBUG)
+
+logger = logging.getLogger(__name__)                    # eventos: ligações, registos, joins
+msg_logger = logging.getLogger(f"{__name__}.messages")  # uma entrada por mensagem (pode ser amostrada)
+
+
+class AsyncServer:
+    """Chat Server built on asyncio streams, speaking the same CDProto framing as Server."""
+
+    def __init__(self, host: str = 'localhost', port: int = 8080, max_queued: int = 1024 * 1024):
+        """Initializes the server.
+
+        max_queued: bytes that may wait in a client's transport buffer before it is disconnected
+        """
+
+        self.host = host
+        self.port = port
+        self.max_queued = max_queued
+        self.server = None
+
+        self.total_clients = {}     # writer : [user, [list_of_channels]]
+        self.channels = {}          # channel : set(writers) -> índice dos membros de cada canal
+        self.binary = set()         # writers que negociaram o formato binário no register
+        self.compressed = set()     # writers que aceitam frames comprimidas com zlib
+
+
+
+    async def start(self):
+        """Starts listening for clients."""
+
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print("--- Server Opened ---")
+
+
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Coroutine that serves one client until it leaves."""
+
+        logger.info('Connected to %s', writer.get_extra_info("peername"))
+
+        try:
+            while True:
+                binary = writer in self.binary
+                header = int.from_bytes(await reader.readexactly(4 if binary else 2), "big")
+                if header > MAX_FRAME:      # não guardar em memória uma frame que nunca seria aceite
+                    raise CDProtoBadFormat()
+                msg = CDProto.decode_msg(await reader.readexactly(header), binary)
+
+                if msg:
+                    self.handle_msg(writer, msg)
+
+                # flow control cooperativo: se este cliente não está a ler o que lhe enviamos,
+                # deixamos de ler o que ele envia até o buffer de saída esvaziar
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError, CDProtoBadFormat):
+            pass
+
+        finally:
+            self.disconnect(writer)
+
+
+
+    def handle_msg(self, writer, msg):
+        """Processes a Message received from writer."""
+
+        if msg.command == "register":
+            logger.info('>> %s joined the server', msg.user)
+            self.total_clients[writer] = [msg.user, [None]]
+            self.channels.setdefault(None, set()).add(writer)
+
+            if BINARY in msg.caps:
+                self.binary.add(writer)
+            if ZLIB in msg.caps:
+                self.compressed.add(writer)
+
+        elif msg.command == "join":
+            channel = msg.channel
+
+            if channel in self.total_clients[writer][1]: # caso o cliente volte a entrar num canal, é eliminado da lista de channels, para evitar repetições
+                self.total_clients[writer][1].remove(channel)
+
+            self.total_clients[writer][1].append(channel)
+            self.channels.setdefault(channel, set()).add(writer)
+            logger.info('>> %s joined the channel %s', self.total_clients[writer][0], channel)
+
+        elif msg.command == "message":
+
+            channel = msg.channel
+            broadcast_msg = f'<<{channel}>> [{self.total_clients[writer][0]}]: {msg.message}'
+
+            msg = CDProto.message(broadcast_msg, channel)
+
+            msg_logger.info('%s | channels: %s', broadcast_msg, self.total_clients[writer][1])
+
+            self.send_broadcast_msg(writer, channel, msg)
+
+
+
+    def disconnect(self, writer):
+        """Removes writer from the server."""
+
+        if writer in self.total_clients:
+            user, channels = self.total_clients.pop(writer)
+            logger.info('>> %s has left the server', user)
+
+            for channel in channels:
+                members = self.channels.get(channel)
+                if members is not None:
+                    members.discard(writer)
+                    if not members:
+                        del self.channels[channel]
+
+        self.binary.discard(writer)
+        self.compressed.discard(writer)
+        writer.close()
+
+
+
+    def send_broadcast_msg(self, writer, channel, msg):
+        '''Envia a TextMessage para todos os membros do canal (exceto quem a enviou)'''
+
+        frames = {}     # frame codificada (e comprimida) uma única vez por formato
+        frames[False] = CDProto.encode_msg(msg)     # antes de enviar a alguém: falha se não couber numa frame
+
+        slow = []
+        for member in self.channels.get(channel, ()):
+            if member is writer:
+                continue
+
+            binary = member in self.binary
+            frame = frames.get(binary)
+            if frame is None:
+                frame = frames[binary] = CDProto.encode_msg(msg, binary)
+
+            if member in self.compressed:
+                packed = frames.get((binary, ZLIB))
+                if packed is None:
+                    packed = frames[(binary, ZLIB)] = CDProto.compress(frame, binary)
+                frame = packed
+
+            member.write(frame)     # não bloqueia: a frame fica no buffer do transport
+            if member.transport.get_write_buffer_size() > self.max_queued:
+                slow.append(member)
+
+        for member in slow:         # clientes que não acompanham o ritmo são desligados
+            self.disconnect(member)
+
+
+
+    async def serve(self):
+        """Serves clients until cancelled."""
+
+        if self.server is None:
+            await self.start()
+
+        async with self.server:
+            await self.server.serve_forever()
+
+
+
+    def loop(self):
+        """Loop indefinetely."""
+
+        asyncio.run(self.serve())
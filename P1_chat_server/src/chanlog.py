@@ -0,0 +1,269 @@
+"""Durable append-only log of the messages of each channel."""
+import hashlib
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_right, bisect_left
+from collections import OrderedDict
+
+_RECORD = struct.Struct("!Iq")      # tamanho da frame, ts
+
+
+class Segment:
+    """One file of a channel log, holding the records from offset base onwards."""
+
+    def __init__(self, path: str, base: int):
+        self.path = path
+        self.base = base
+        self.positions = array("Q")     # posição de cada registo no ficheiro
+        self.stamps = array("q")        # ts de cada registo
+        self.size = 0
+        self.map = None                 # mmap usado nas leituras
+        self.mapped = 0                 # tamanho do ficheiro quando foi feito o mmap
+
+        self.file = open(path, "ab")
+        self.scan()
+
+    def scan(self):
+        """Rebuilds the index of an existing segment, dropping a torn last record."""
+
+        size = os.path.getsize(self.path)
+        if size == 0:
+            return
+
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos = 0
+            while pos + _RECORD.size <= size:
+                length, ts = _RECORD.unpack_from(data, pos)
+                if pos + _RECORD.size + length > size:
+                    break
+                self.positions.append(pos)
+                self.stamps.append(ts)
+                pos += _RECORD.size + length
+
+        if pos < size:      # escrita interrompida a meio de um registo
+            self.file.truncate(pos)
+        self.size = pos
+
+    def __len__(self):
+        return len(self.positions)
+
+    def append(self, frame: bytes, ts: int):
+        self.positions.append(self.size)
+        self.stamps.append(ts)
+        self.file.write(_RECORD.pack(len(frame), ts))
+        self.file.write(frame)
+        self.size += _RECORD.size + len(frame)
+
+    def view(self):
+        """Memory map of the segment (remapped if it grew since the last read)."""
+
+        if self.map is None or self.mapped != self.size:
+            if self.file is not None:
+                self.file.flush()
+            if self.map is not None:
+                self.map.close()
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mapped = self.size
+        return self.map
+
+    def seal(self):
+        """Makes the segment durable and closes it for writing (only read from then on)."""
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        if self.file is not None:
+            self.file.close()
+
+
+class ChannelLog:
+    """Append-only, segmented log of the frames sent to one channel.
+
+    Every record gets an offset (0, 1, 2, ...). Appends go through the file's
+    write buffer; durability comes from sync(), called in groups by LogStore.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".log"):
+                self.segments.append(Segment(os.path.join(directory, name), int(name[:-4])))
+        for segment in self.segments[:-1]:      # só o último volta a receber registos
+            segment.seal()
+        if not self.segments:
+            self.roll(0)
+
+    @property
+    def next_offset(self) -> int:
+        last = self.segments[-1]
+        return last.base + len(last)
+
+    def roll(self, base: int):
+        """Starts a new segment at offset base."""
+
+        if self.segments:       # sync() só trata do último segmento: o anterior fica em disco já aqui
+            self.segments[-1].seal()
+        self.segments.append(Segment(os.path.join(self.directory, f"{base:020d}.log"), base))
+
+        fd = os.open(self.directory, os.O_RDONLY)      # o novo ficheiro também tem de sobreviver a um crash
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def append(self, frame: bytes, ts: int) -> int:
+        """Appends a frame and returns its offset."""
+
+        if self.segments[-1].size >= self.segment_bytes:
+            self.roll(self.next_offset)
+
+        offset = self.next_offset
+        self.segments[-1].append(frame, ts)
+        return offset
+
+    def find(self, ts: int) -> int:
+        """Offset of the first record with a ts greater or equal to ts."""
+
+        for segment in self.segments:
+            if segment.stamps and segment.stamps[-1] >= ts:
+                return segment.base + bisect_left(segment.stamps, ts)
+        return self.next_offset
+
+    def read(self, offset: int, max_bytes: int = 256 * 1024, end: int = None):
+        """Reads frames from offset onwards (about max_bytes of them, stopping before end).
+
+        Returns the list of frames (memoryviews over the mmap, valid until the
+        next read) and the offset that follows the last one returned.
+        """
+
+        end = self.next_offset if end is None else min(end, self.next_offset)
+        offset = max(offset, self.segments[0].base)
+        index = bisect_right([segment.base for segment in self.segments], offset) - 1
+
+        frames = []
+        total = 0
+        while offset < end and total < max_bytes:
+            segment = self.segments[index]
+            first = offset - segment.base
+            if first >= len(segment):
+                index += 1
+                continue
+
+            data = memoryview(segment.view())
+            pos = segment.positions[first]
+            while pos < segment.size and offset < end and total < max_bytes:    # leitura sequencial do segmento
+                length, _ = _RECORD.unpack_from(data, pos)
+                start = pos + _RECORD.size
+                frames.append(data[start:start + length])
+                total += length
+                pos = start + length
+                offset += 1
+
+            index += 1
+
+        return frames, offset
+
+    def sync(self):
+        """Makes every appended record durable."""
+
+        file = self.segments[-1].file
+        file.flush()
+        os.fsync(file.fileno())
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+
+class LogStore:
+    """Channel logs of a server, with group commit."""
+
+    def __init__(self, root: str, commit_interval: float = 0.05, segment_bytes: int = 64 * 1024 * 1024,
+                 max_open: int = 256):
+        """root: directory of the logs; commit_interval: maximum seconds between fsyncs of new records;
+        max_open: logs kept open at once (the least recently used one is closed to open another)."""
+
+        self.root = root
+        self.commit_interval = commit_interval
+        self.segment_bytes = segment_bytes
+        self.max_open = max_open
+        self.logs = OrderedDict()   # channel : ChannelLog, do menos para o mais recentemente usado
+        self.dirty = set()          # canais com registos ainda sem fsync
+        self.last_commit = time.monotonic()
+
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, channel) -> str:
+        """Directory of the log of channel."""
+
+        if channel is None:
+            return os.path.join(self.root, "default")
+        name = channel.encode("UTF-8")
+        if len(name) <= 64:
+            return os.path.join(self.root, name.hex())
+        # nomes longos não cabem num nome de ficheiro: o hash tem tamanho fixo (e não é hex de comprimento par)
+        return os.path.join(self.root, "h" + hashlib.sha256(name).hexdigest())
+
+    def get(self, channel, create: bool = True) -> ChannelLog:
+        """Log of channel (None if it has none and create is False)."""
+
+        log = self.logs.get(channel)
+        if log is not None:
+            self.logs.move_to_end(channel)
+            return log
+
+        path = self.path(channel)
+        if not create and not os.path.isdir(path):
+            return None
+
+        if len(self.logs) >= self.max_open:     # cada log aberto ocupa descritores de ficheiros
+            old, oldest = self.logs.popitem(last=False)
+            if old in self.dirty:
+                oldest.sync()
+                self.dirty.discard(old)
+            oldest.close()
+
+        log = self.logs[channel] = ChannelLog(path, self.segment_bytes)
+        return log
+
+    def append(self, channel, frame: bytes, ts: int) -> int:
+        """Appends a frame to the log of channel and returns its offset."""
+
+        self.dirty.add(channel)
+        return self.get(channel).append(frame, ts)
+
+    def timeout(self):
+        """Seconds until the next commit is due (None when there is nothing to commit)."""
+
+        if not self.dirty:
+            return None
+        return max(0, self.last_commit + self.commit_interval - time.monotonic())
+
+    def commit(self, force: bool = False):
+        """fsyncs every channel with new records, at most once per commit_interval."""
+
+        if not self.dirty or not force and self.timeout() > 0:
+            return
+
+        for channel in self.dirty:
+            self.logs[channel].sync()
+        self.dirty.clear()
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.commit(force=True)
+        for log in self.logs.values():
+            log.close()
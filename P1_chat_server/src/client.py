@@ -6,7 +6,7 @@ import sys
 import fcntl
 import os
 
-from .protocol import CDProto, CDProtoBadFormat, TextMessage
+from .protocol import BINARY, ZLIB, CDProto, CDProtoBadFormat, CDProtoStream, TextMessage
 
 logging.basicConfig(filename=f"{sys.argv[0]}.log", level=logging.DEBUG)
 
@@ -14,40 +14,63 @@ logging.basicConfig(filename=f"{sys.argv[0]}.log", level=logging.DEBUG)
 class Client:
     """Chat Client process."""
 
-    def __init__(self, name: str = "Foo"):
-        """Initializes chat client."""
+    def __init__(self, name: str = "Foo", binary: bool = False, compress: bool = False,
+                 host: str = "localhost", port: int = 8080):
+        """Initializes chat client.
 
+        binary: negotiate the compact binary wire format at register time
+        compress: accept large frames compressed with zlib
+        """
+
+        self.address = (host, port)
         self.username = name
+        self.binary = binary
+        self.compress = compress
         self.client_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sel = selectors.DefaultSelector()
         self.CDP = CDProto()
         self.channel = [None]  # incialmente o cliente não está em nenhum server
+        self.offsets = {}      # channel : offset da próxima mensagem que ainda não vimos
 
 
 
     def connect(self):
         """Connect to chat server and setup stdin flags."""
 
-        host = 'localhost'
-        port = 8080
-        self.client_sock.connect((host, port))
+        self.client_sock.connect(self.address)
+        self.stream = CDProtoStream(self.client_sock)
         
         self.sel.register(self.client_sock, selectors.EVENT_READ, self.recv_data)
 
         # enviar mensagem do tipo register
-        register_type = self.CDP.register(self.username)
+        caps = [BINARY] if self.binary else []
+        if self.compress:
+            caps.append(ZLIB)
+        register_type = self.CDP.register(self.username, caps)
         self.CDP.send_msg(self.client_sock, register_type)
 
+        self.stream.binary = self.binary     # depois do register, tudo segue no formato negociado
+
 
 
     # função para receber mensagens
     def recv_data(self, sock, mask):
 
-        msg = self.CDP.recv_msg(self.client_sock)
-        logging.debug('received "%s', msg)
+        self.stream.fill()
+
+        msg = self.CDP.recv_msg(self.stream)
+        while msg:          # podem ter chegado várias mensagens de uma só vez
+            logging.debug('received "%s', msg)
+
+            if type(msg) is TextMessage:
+                if msg.offset is not None:      # as mensagens repostas podem chegar depois das novas
+                    self.offsets[msg.channel] = max(self.offsets.get(msg.channel, 0), msg.offset + 1)
+                print(msg.message)
 
-        if type(msg) is TextMessage:
-            print(msg.message)
+            elif msg.command == "ping":     # o servidor quer saber se ainda estamos ligados
+                self.client_sock.sendall(self.CDP.encode_msg(self.CDP.pong(), self.binary))
+
+            msg = self.CDP.recv_msg(self.stream)
 
 
 
@@ -72,13 +95,25 @@ class Client:
                     self.channel.append(data.split()[1].strip())
                     
                     join_type = self.CDP.join(self.channel[-1])
-                    self.CDP.send_msg(self.client_sock, join_type)
+                    self.client_sock.sendall(self.CDP.encode_msg(join_type, self.binary))
 
                     print(f'>> {self.username} has left and joined the server {self.channel[-1]}')
 
+            elif data.split()[0].strip() == "/resume":     # pedir as mensagens perdidas do canal "/resume [offset]"
+                offset = self.offsets.get(self.channel[-1], 0)
+                if len(data.split()) == 2 and data.split()[1].isdigit():
+                    offset = int(data.split()[1])
+                    self.offsets[self.channel[-1]] = offset
+
+                resume_type = self.CDP.resume(self.channel[-1], offset)
+                self.client_sock.sendall(self.CDP.encode_msg(resume_type, self.binary))
+
             else:
                 mensagem = self.CDP.message(data, self.channel[-1]) 
-                self.CDP.send_msg(self.client_sock, mensagem)
+                try:
+                    self.client_sock.sendall(self.CDP.encode_msg(mensagem, self.binary))
+                except CDProtoBadFormat:        # não cabe numa frame
+                    print('>> message too long')
             
 
 
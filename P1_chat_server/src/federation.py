@@ -0,0 +1,145 @@
+"""Server to server federation of chat channels."""
+import errno
+import hmac
+import logging
+import selectors
+import socket
+import time
+
+from .protocol import CDProto
+
+logger = logging.getLogger(__name__)
+
+
+class Federation:
+    """Links of a chat server to the other servers of a (full mesh) federation.
+
+    Every pair of servers shares a single TCP link, opened by the server with the
+    smallest node id. Over it each server announces the channels where it has
+    local members (InterestMessage) and forwards the channel messages of its own
+    clients, only to the peers interested in that channel. Messages received from
+    a peer are delivered locally and never forwarded again, so a message crosses
+    each link at most once.
+    """
+
+    def __init__(self, server, node: str, peers: list, secret: str = None, retry: float = 1):
+        """node: "host:port" of this server; peers: "host:port" of every other server.
+
+        Only the listed peers, connecting from the address their host resolves
+        to (and knowing secret, when there is one), are accepted as servers.
+        retry: seconds between the attempts to open a missing link.
+        """
+
+        self.server = server
+        self.node = node
+        self.secret = secret
+        self.retry = retry
+        self.addresses = {peer: self.resolve(peer) for peer in peers}    # resolvidos já, fora do loop
+        self.links = {}         # socket : node id do servidor do outro lado
+        self.interest = {}      # socket : set(channels) com membros no servidor do outro lado
+        self.pending = {peer for peer in peers if peer > node}     # servidores que somos nós a ligar
+        self.connecting = {}    # socket : node -> ligações ainda a meio do connect
+        self.next_dial = 0.0
+
+    @staticmethod
+    def resolve(node: str) -> tuple:
+        host, port = node.rsplit(":", 1)
+        try:
+            return socket.gethostbyname(host), int(port)
+        except OSError:
+            return host, int(port)
+
+    def dial(self):
+        """Starts (without blocking) the connects of the links that are still missing."""
+
+        now = time.monotonic()
+        if now < self.next_dial:
+            return
+        self.next_dial = now + self.retry
+
+        for node in list(self.pending):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            err = sock.connect_ex(self.addresses[node])
+            if err not in (0, errno.EINPROGRESS):
+                sock.close()
+                continue        # o outro servidor ainda não está à escuta, tenta-se mais tarde
+
+            self.pending.discard(node)
+            self.connecting[sock] = node
+            self.server.sel.register(sock, selectors.EVENT_WRITE, self.connected)
+
+    def connected(self, sock, mask):
+        """Finishes the connect of a link (the selector saw the socket writable)."""
+
+        node = self.connecting.pop(sock)
+        self.server.sel.unregister(sock)
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+            sock.close()
+            self.pending.add(node)
+            return
+
+        self.server.add_connection(sock)
+        self.server.send(sock, CDProto.encode_msg(CDProto.peer(self.node, self.secret)))
+        self.link_up(sock, node)
+
+    def hello(self, conn, msg):
+        """Processes the PeerMessage of a connection claiming to be a server that opened a link to us."""
+
+        node = msg.node
+        try:
+            host = conn.getpeername()[0]
+        except OSError:
+            host = None
+
+        if (node not in self.addresses or node in self.links.values() or conn in self.server.total_clients
+                or host != self.addresses[node][0]
+                or (self.secret is not None and not hmac.compare_digest(msg.secret or "", self.secret))):
+            logger.info('>> rejected peer %s from %s', node, host)
+            self.server.disconnect(conn)
+            return
+
+        self.link_up(conn, node)
+
+    def link_up(self, conn, node: str):
+        """Registers a link and announces our channels through it."""
+
+        logger.info('>> linked to server %s', node)
+        self.links[conn] = node
+        self.interest[conn] = set()
+        self.server.buckets.pop(conn, None)     # um servidor agrega muitos clientes: sem rate limit
+
+        for channel in self.server.channels:
+            self.server.send(conn, CDProto.encode_msg(CDProto.interest(channel, True)))
+
+    def link_down(self, conn):
+        """Forgets a link (it will be dialed again if it was ours)."""
+
+        node = self.links.pop(conn)
+        self.interest.pop(conn, None)
+        logger.info('>> lost link to server %s', node)
+
+        if node > self.node:
+            self.pending.add(node)
+
+    def update(self, conn, msg):
+        """Processes an InterestMessage received from a peer."""
+
+        if msg.active:
+            self.interest[conn].add(msg.channel)
+        else:
+            self.interest[conn].discard(msg.channel)
+
+    def channel_changed(self, channel, active: bool):
+        """Announces to every peer that we now have (or no longer have) members in channel."""
+
+        frame = CDProto.encode_msg(CDProto.interest(channel, active))
+        for conn in self.links:
+            self.server.send(conn, frame)
+
+    def forward(self, channel, frame: bytes):
+        """Forwards a channel frame of a local client to the interested peers."""
+
+        for conn, channels in self.interest.items():
+            if channel in channels:
+                self.server.send(conn, frame)
@@ -0,0 +1,117 @@
+"""Logging setup for the chat server (synchronous or queued)."""
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through only one out of every rate records."""
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = max(1, rate)
+        self.count = 0
+
+    def filter(self, record) -> bool:
+        self.count += 1
+        return (self.count - 1) % self.rate == 0
+
+
+class EnqueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves the formatting by the handlers' formatters to the writer thread.
+
+    The message itself is merged with its args here, in the logging thread:
+    args may be live objects (like the channel list of a client) that the
+    server loop keeps changing while the record waits in the queue.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class QueuedLogWriter(threading.Thread):
+    """Background thread that formats and writes queued log records in batches."""
+
+    def __init__(self, records: queue.SimpleQueue, handlers: list, batch: int = 512):
+        super().__init__(name="log-writer", daemon=True)
+        self.records = records
+        self.handlers = handlers
+        self.batch = batch
+
+    def run(self):
+        while True:
+            record = self.records.get()         # bloqueia só esta thread, nunca o loop do servidor
+            if record is None:
+                break
+
+            batch = [record]
+            while len(batch) < self.batch:
+                try:
+                    record = self.records.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self.write(batch)
+                    return
+                batch.append(record)
+
+            self.write(batch)
+
+    def write(self, batch):
+        """Formats a batch and writes it with a single write (and flush) per handler."""
+
+        for handler in self.handlers:
+            lines = [handler.format(r) + "\n" for r in batch if r.levelno >= handler.level and handler.filter(r)]
+            if lines:
+                handler.stream.write("".join(lines))
+                handler.stream.flush()
+
+    def stop(self):
+        self.records.put(None)
+        self.join()
+
+
+def setup_logging(filename: str = "server.log", queued: bool = False, sample: int = 1):
+    """Configures the server loggers.
+
+    Records always go to filename and server events (src.server, INFO and above)
+    are also shown on stdout. With queued=True the calling thread only enqueues
+    records and a QueuedLogWriter writes them. sample=N keeps one out of every N
+    per-message records (loggers named *.messages). Returns the QueuedLogWriter
+    (None when not queued), whose stop() writes whatever is still queued.
+    """
+
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(logging.INFO)
+    console.addFilter(lambda record: record.name.startswith("src."))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:        # substituir o basicConfig feito no import
+        root.removeHandler(handler)
+        handler.close()
+    root.setLevel(logging.DEBUG)
+
+    if queued:
+        records = queue.SimpleQueue()
+        writer = QueuedLogWriter(records, [file_handler, console])
+        writer.start()
+        atexit.register(writer.stop)
+        root.addHandler(EnqueueHandler(records))
+    else:
+        writer = None
+        root.addHandler(file_handler)
+        root.addHandler(console)
+
+    if sample > 1:
+        for name in ("src.server.messages", "src.async_server.messages"):
+            logging.getLogger(name).addFilter(SamplingFilter(sample))
+
+    return writer
@@ -0,0 +1,98 @@
+"""Counters and histograms of a running chat server."""
+import time
+
+
+class Histogram:
+    """Histogram of durations in power of two microsecond buckets.
+
+    observe() is a couple of integer operations, cheap enough to run for every
+    callback of the event loop; percentiles are only as precise as the buckets.
+    """
+
+    def __init__(self):
+        self.counts = [0] * 40      # bucket b: durações até 2**b microssegundos
+        self.total = 0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        us = int(seconds * 1e6)
+        self.counts[min(us.bit_length(), 39)] += 1
+        self.total += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> int:
+        """Upper bound (in microseconds) of the bucket holding the p-th percentile."""
+
+        rank = self.total * p
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return 2 ** bucket
+        return 0
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.total,
+            "p50_us": self.percentile(0.5),
+            "p99_us": self.percentile(0.99),
+            "p999_us": self.percentile(0.999),
+            "max_us": round(self.max * 1e6),
+            "buckets_us": {2 ** b: count for b, count in enumerate(self.counts) if count},
+        }
+
+
+class Metrics:
+    """Counters updated by the server loop, and the per second rates derived from them."""
+
+    def __init__(self):
+        self.frames_in = 0
+        self.frames_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.loop_time = Histogram()        # trabalho de cada iteração do loop (sem a espera no select)
+        self.callback_time = Histogram()    # cada callback chamado pelo loop
+
+        self.started = time.monotonic()
+        self.window = (self.started, 0, 0, 0, 0)   # início da janela atual e contadores nesse instante
+        self.rates = {"frames_in": 0.0, "frames_out": 0.0, "bytes_in": 0.0, "bytes_out": 0.0}
+
+    def tick(self, now: float):
+        """Closes the current one second window (called once per loop iteration)."""
+
+        start, frames_in, frames_out, bytes_in, bytes_out = self.window
+        elapsed = now - start
+        if elapsed < 1:
+            return
+
+        self.rates = {
+            "frames_in": (self.frames_in - frames_in) / elapsed,
+            "frames_out": (self.frames_out - frames_out) / elapsed,
+            "bytes_in": (self.bytes_in - bytes_in) / elapsed,
+            "bytes_out": (self.bytes_out - bytes_out) / elapsed,
+        }
+        self.window = (now, self.frames_in, self.frames_out, self.bytes_in, self.bytes_out)
+
+    def snapshot(self, server) -> dict:
+        """Current state of server, as a json serializable dict."""
+
+        return {
+            "uptime": time.monotonic() - self.started,
+            "connections": len(server.streams),
+            "clients": len(server.total_clients),
+            "channels": len(server.channels),
+            "members": {str(channel): len(members) for channel, members in server.channels.items()},
+            "frames_in": self.frames_in,
+            "frames_out": self.frames_out,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "per_second": self.rates,
+            "queued_bytes": sum(server.queued.values()),
+            # por fd: o mesmo username pode estar em várias ligações (e um servidor federado não tem nenhum)
+            "queued": {str(conn.fileno()): {"user": server.total_clients.get(conn, [None])[0], "bytes": size}
+                       for conn, size in server.queued.items() if size},
+            "backlog": len(server.backlog),
+            "loop_time": self.loop_time.snapshot(),
+            "callback_time": self.callback_time.snapshot(),
+        }
@@ -1,12 +1,28 @@
 """Protocol for chat server - Computação Distribuida Assignment 1."""
 import json
+import struct
+import zlib
 from datetime import datetime
 from socket import socket
 
+BINARY = "binary"       # capability: compact binary frames (4-byte header + struct fields)
+ZLIB = "zlib"           # capability: large frames may arrive compressed with zlib
+
+COMPRESS_THRESHOLD = 512        # payloads menores não compensam o custo da compressão
+_MAX_INFLATED = 1024 * 1024     # tamanho máximo de um payload descomprimido
+MAX_FRAME = 0xFFFF              # maior payload de uma frame: o que cabe no header de 2 bytes do JSON
+
+# formato binário: [tamanho (4 bytes)] [tipo (1 byte)] [campos]
+_REGISTER, _JOIN, _MESSAGE, _PING, _PONG, _RESUME = 1, 2, 3, 4, 5, 6
+_TEXT_FIELDS = struct.Struct("!BqqH")      # tipo, ts, offset (-1 = sem offset), tamanho do canal
+_RESUME_FIELDS = struct.Struct("!Bqq")     # tipo, offset, ts (-1 = não indicado)
+
 
 class Message:
     """Message Type."""
 
+    __slots__ = ("command",)
+
     def __init__(self, command):
         self.command = command
     
@@ -17,6 +33,8 @@ class Message:
 class JoinMessage(Message):
     """Message to join a chat channel."""
 
+    __slots__ = ("channel",)
+
     def __init__(self, command, channel):
         super().__init__(command)
         self.channel = channel
@@ -29,38 +47,101 @@ class JoinMessage(Message):
 class RegisterMessage(Message):
     """Message to register username in the server."""
 
-    def __init__(self, command, user):
+    __slots__ = ("user", "caps")
+
+    def __init__(self, command, user, caps = None):
         super().__init__(command)
         self.user = user
+        self.caps = caps or []
     
     def __repr__(self):
-        return f'{{{super().__repr__()}, "user": "{self.user}"}}'
+        if self.caps:
+            return f'{{{super().__repr__()}, "user": "{self.user}", "caps": {json.dumps(self.caps)}}}'
+        else:
+            return f'{{{super().__repr__()}, "user": "{self.user}"}}'
 
 
 class TextMessage(Message):
     """Message to chat with other clients."""
 
-    def __init__(self, command, message, ts, channel = None):
+    __slots__ = ("message", "channel", "ts", "offset")
+
+    def __init__(self, command, message, ts, channel = None, offset = None):
         super().__init__(command)
         self.message = message
         self.channel = channel
         self.ts = ts
+        self.offset = offset    # posição no log do canal, atribuída pelo servidor
     
     def __repr__(self):
+        offset = "" if self.offset is None else f', "offset": {self.offset}'
         if self.channel:
-            return f'{{{super().__repr__()}, "message": "{self.message}", "channel": "{self.channel}", "ts": {self.ts}}}'
+            return f'{{{super().__repr__()}, "message": "{self.message}", "channel": "{self.channel}", "ts": {self.ts}{offset}}}'
         else:
-            return f'{{{super().__repr__()}, "message": "{self.message}", "ts": {self.ts}}}'
+            return f'{{{super().__repr__()}, "message": "{self.message}", "ts": {self.ts}{offset}}}'
+
+
+class PingMessage(Message):
+    """Heartbeat message ("ping" asks the other side to answer with "pong")."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return f'{{{super().__repr__()}}}'
+
+
+class ResumeMessage(Message):
+    """Message asking for the messages of a channel from an offset (or a ts) onwards."""
+
+    __slots__ = ("channel", "offset", "ts")
+
+    def __init__(self, command, channel, offset = None, ts = None):
+        super().__init__(command)
+        self.channel = channel
+        self.offset = offset
+        self.ts = ts
+
+    def __repr__(self):
+        start = f'"ts": {self.ts}' if self.offset is None else f'"offset": {self.offset}'
+        return f'{{{super().__repr__()}, "channel": "{self.channel}", {start}}}'
+
+
+class PeerMessage(Message):
+    """Message that opens a link between two federated chat servers."""
+
+    __slots__ = ("node", "secret")
+
+    def __init__(self, command, node, secret = None):
+        super().__init__(command)
+        self.node = node
+        self.secret = secret    # segredo partilhado pelos servidores (nunca aparece no repr)
+
+    def __repr__(self):
+        return f'{{{super().__repr__()}, "node": "{self.node}"}}'
+
+
+class InterestMessage(Message):
+    """Message telling a federated server whether we have members in a channel."""
+
+    __slots__ = ("channel", "active")
+
+    def __init__(self, command, channel, active):
+        super().__init__(command)
+        self.channel = channel
+        self.active = active
+
+    def __repr__(self):
+        return f'{{{super().__repr__()}, "channel": "{self.channel}", "active": {json.dumps(self.active)}}}'
 
 
 class CDProto:
     """Computação Distribuida Protocol."""
 
     @classmethod
-    def register(cls, username: str) -> RegisterMessage:
-        """Creates a RegisterMessage object."""
+    def register(cls, username: str, caps: list = None) -> RegisterMessage:
+        """Creates a RegisterMessage object, optionally announcing client capabilities."""
 
-        return RegisterMessage("register", username)
+        return RegisterMessage("register", username, caps)
     
     @classmethod
     def join(cls, channel: str) -> JoinMessage:
@@ -75,56 +156,328 @@ class CDProto:
         return TextMessage("message", message, int(datetime.now().timestamp()), channel)
 
     @classmethod
-    def send_msg(cls, connection: socket, msg: Message):
-        """Sends through a connection a Message object."""
+    def ping(cls) -> PingMessage:
+        """Creates a ping PingMessage object."""
+
+        return PingMessage("ping")
+
+    @classmethod
+    def pong(cls) -> PingMessage:
+        """Creates a pong PingMessage object (the answer to a ping)."""
+
+        return PingMessage("pong")
+
+    @classmethod
+    def resume(cls, channel: str, offset: int = None, ts: int = None) -> ResumeMessage:
+        """Creates a ResumeMessage object (offset is the first one wanted, or else the first message from ts)."""
+
+        return ResumeMessage("resume", channel, offset, ts)
+
+    @classmethod
+    def peer(cls, node: str, secret: str = None) -> PeerMessage:
+        """Creates a PeerMessage object (server to server only)."""
+
+        return PeerMessage("peer", node, secret)
+
+    @classmethod
+    def interest(cls, channel: str, active: bool) -> InterestMessage:
+        """Creates an InterestMessage object (server to server only)."""
+
+        return InterestMessage("interest", channel, active)
+
+    @classmethod
+    def encode_msg(cls, msg: Message, binary: bool = False) -> bytes:
+        """Encodes a Message object into a ready to send frame (header + json, or binary).
 
-        if type(msg) is RegisterMessage:
-            json_msg = json.dumps({"command": "register", "user": msg.user}).encode("UTF-8")
+        Raises CDProtoBadFormat when the payload is over MAX_FRAME bytes.
+        """
 
-        elif type(msg) is JoinMessage:
-            json_msg = json.dumps({"command": "join", "channel": msg.channel}).encode("UTF-8")
+        if binary:
+            payload = _BINARY_ENCODERS[type(msg)](msg)
+            size = 4
+        else:
+            payload = _JSON_ENCODERS[type(msg)](msg)
+            size = 2
+
+        if len(payload) > MAX_FRAME:    # p.ex. uma mensagem binária grande que tem de seguir em JSON
+            raise CDProtoBadFormat(payload[:64])
+        return len(payload).to_bytes(size, "big") + payload
+
+    @classmethod
+    def compress(cls, frame: bytes, binary: bool = False, threshold: int = COMPRESS_THRESHOLD) -> bytes:
+        """Compresses the payload of a frame, when it is at least threshold bytes and zlib makes it smaller.
+
+        A compressed payload starts with the zlib header byte 0x78 ("x"), which no
+        JSON ("{") nor binary (type 1-6) payload does, so decode_msg recognizes it.
+        """
+
+        size = 4 if binary else 2
+        if len(frame) - size < threshold:
+            return frame
+
+        payload = zlib.compress(frame[size:])
+        if len(payload) >= len(frame) - size:
+            return frame
+        return len(payload).to_bytes(size, "big") + payload
 
-        elif type(msg) is TextMessage:
-            json_msg = json.dumps({"command": "message", "message": msg.message, "channel": msg.channel, "ts": int(datetime.now().timestamp()) }).encode("UTF-8")
+    @classmethod
+    def send_msg(cls, connection: socket, msg: Message):
+        """Sends through a connection a Message object."""
 
-        header = len(json_msg).to_bytes(2, "big")
-        connection.sendall(header + json_msg)
+        connection.sendall(cls.encode_msg(msg))
         
 
     @classmethod
     def recv_msg(cls, connection: socket) -> Message:
-        """Receives through a connection a Message object."""
+        """Receives through a connection a Message object.
+
+        CDProtoStreams switched to binary mode are read with the binary framing.
+        """
+
+        binary = getattr(connection, "binary", False)
+
+        header = int.from_bytes(connection.recv(4 if binary else 2), "big")
+        if header == 0: return
+
+        return cls.decode_msg(connection.recv(header), binary)
+
+    @classmethod
+    def decode_msg(cls, payload: bytes, binary: bool = False) -> Message:
+        """Decodes the payload of a frame (without header) into a Message object."""
+
+        if payload[:1] == b"x":     # payload comprimido (ver compress)
+            inflater = zlib.decompressobj()
+            try:
+                payload = inflater.decompress(payload, _MAX_INFLATED)
+            except zlib.error:
+                raise CDProtoBadFormat(payload)
+            if inflater.unconsumed_tail:
+                raise CDProtoBadFormat(payload[:64])
 
         try:
+            if binary:
+                decoder = _BINARY_DECODERS.get(payload[0])
+                if decoder is not None:
+                    return decoder(payload)
 
-            header = int.from_bytes(connection.recv(2), "big")
-            if header == 0: return
-            
-            dic_msg = connection.recv(header).decode("UTF-8")
+            else:
+                dic = _json_decode(payload.decode("UTF-8"))
+                decoder = _JSON_DECODERS.get(dic["command"])
+                return decoder(dic) if decoder is not None else None
 
-            dic = json.loads(dic_msg)
+        except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError,
+                IndexError, struct.error):
+            pass
 
-        except json.JSONDecodeError as err:
-            raise CDProtoBadFormat(dic_msg)
+        raise CDProtoBadFormat(payload)
 
-        if dic["command"] == "register":
-            user = dic["user"]
-            return CDProto.register(user)
 
-        elif dic["command"] == "join":
-            channel = dic["channel"]
-            return CDProto.join(channel)
+# Codec: um encoder e um decoder por tipo de mensagem, escolhidos numa só consulta ao dicionário
+# (em vez de uma cadeia de ifs por mensagem). A ordem das chaves do JSON é a de sempre.
 
-        elif dic["command"] == "message":
-   
-            msg = dic["message"]
+_json_encode = json.JSONEncoder().encode
+_json_decode = json.JSONDecoder().decode
 
-            if dic.get("channel"):  # caso haja canal ou não
-                return CDProto.message(msg, dic["channel"])
 
-            else:
-                return CDProto.message(msg)
-            
+def _json_register(msg):
+    if msg.caps:
+        return _json_encode({"command": "register", "user": msg.user, "caps": msg.caps}).encode("UTF-8")
+    return _json_encode({"command": "register", "user": msg.user}).encode("UTF-8")
+
+
+def _json_text(msg):
+    if msg.offset is None:
+        return _json_encode({"command": "message", "message": msg.message, "channel": msg.channel, "ts": msg.ts}).encode("UTF-8")
+    return _json_encode({"command": "message", "message": msg.message, "channel": msg.channel, "ts": msg.ts,
+                         "offset": msg.offset}).encode("UTF-8")
+
+
+def _json_resume(msg):
+    if msg.offset is None:
+        return _json_encode({"command": "resume", "channel": msg.channel, "ts": msg.ts}).encode("UTF-8")
+    return _json_encode({"command": "resume", "channel": msg.channel, "offset": msg.offset}).encode("UTF-8")
+
+
+def _json_peer(msg):
+    if msg.secret is None:
+        return _json_encode({"command": "peer", "node": msg.node}).encode("UTF-8")
+    return _json_encode({"command": "peer", "node": msg.node, "secret": msg.secret}).encode("UTF-8")
+
+
+_JSON_ENCODERS = {
+    RegisterMessage: _json_register,
+    JoinMessage: lambda msg: _json_encode({"command": "join", "channel": msg.channel}).encode("UTF-8"),
+    TextMessage: _json_text,
+    ResumeMessage: _json_resume,
+    PingMessage: lambda msg: _json_encode({"command": msg.command}).encode("UTF-8"),
+    PeerMessage: _json_peer,
+    InterestMessage: lambda msg: _json_encode({"command": "interest", "channel": msg.channel,
+                                               "active": msg.active}).encode("UTF-8"),
+}
+
+
+def _from_json_message(dic):
+    ts = dic.get("ts")
+    if ts is None:
+        ts = int(datetime.now().timestamp())
+    # mensagens repostas do log mantêm o ts original
+    return TextMessage("message", dic["message"], ts, dic.get("channel") or None, dic.get("offset"))
+
+
+def _from_json_resume(dic):
+    channel, offset, ts = dic["channel"], dic.get("offset"), dic.get("ts")
+    # vão direto para ChannelLog.find/read: um tipo errado não pode chegar lá
+    if channel is not None and not isinstance(channel, str):
+        raise CDProtoBadFormat(repr(dic).encode("UTF-8"))
+    for value in (offset, ts):
+        if value is not None and (type(value) is not int or value < 0):
+            raise CDProtoBadFormat(repr(dic).encode("UTF-8"))
+    return ResumeMessage("resume", channel, offset, ts)
+
+
+_JSON_DECODERS = {
+    "register": lambda dic: RegisterMessage("register", dic["user"], dic.get("caps")),
+    "join": lambda dic: JoinMessage("join", dic["channel"]),
+    "message": _from_json_message,
+    "resume": _from_json_resume,
+    "ping": lambda dic: PingMessage("ping"),
+    "pong": lambda dic: PingMessage("pong"),
+    "peer": lambda dic: PeerMessage("peer", dic["node"], dic.get("secret")),
+    "interest": lambda dic: InterestMessage("interest", dic["channel"], dic["active"]),
+}
+
+
+_PING_PAYLOAD, _PONG_PAYLOAD = bytes([_PING]), bytes([_PONG])
+
+
+def _binary_text(msg):
+    channel = msg.channel.encode("UTF-8") if msg.channel else b""
+    offset = -1 if msg.offset is None else msg.offset
+    return _TEXT_FIELDS.pack(_MESSAGE, msg.ts, offset, len(channel)) + channel + msg.message.encode("UTF-8")
+
+
+def _binary_resume(msg):
+    offset = -1 if msg.offset is None else msg.offset
+    ts = -1 if msg.ts is None else msg.ts
+    return _RESUME_FIELDS.pack(_RESUME, offset, ts) + (msg.channel or "").encode("UTF-8")
+
+
+_BINARY_ENCODERS = {
+    RegisterMessage: lambda msg: bytes([_REGISTER]) + msg.user.encode("UTF-8"),
+    JoinMessage: lambda msg: bytes([_JOIN]) + msg.channel.encode("UTF-8"),
+    TextMessage: _binary_text,
+    ResumeMessage: _binary_resume,
+    PingMessage: lambda msg: _PING_PAYLOAD if msg.command == "ping" else _PONG_PAYLOAD,
+}
+
+
+def _from_binary_text(payload):
+    _, ts, offset, size = _TEXT_FIELDS.unpack_from(payload)
+    start = _TEXT_FIELDS.size
+    channel = payload[start:start + size].decode("UTF-8") or None
+    message = payload[start + size:].decode("UTF-8")
+    return TextMessage("message", message, ts, channel, None if offset < 0 else offset)
+
+
+def _from_binary_resume(payload):
+    _, offset, ts = _RESUME_FIELDS.unpack_from(payload)
+    channel = payload[_RESUME_FIELDS.size:].decode("UTF-8") or None
+    return ResumeMessage("resume", channel, None if offset < 0 else offset, None if ts < 0 else ts)
+
+
+_BINARY_DECODERS = {
+    _REGISTER: lambda payload: RegisterMessage("register", payload[1:].decode("UTF-8")),
+    _JOIN: lambda payload: JoinMessage("join", payload[1:].decode("UTF-8")),
+    _MESSAGE: _from_binary_text,
+    _RESUME: _from_binary_resume,
+    _PING: lambda payload: PingMessage("ping"),
+    _PONG: lambda payload: PingMessage("pong"),
+}
+
+
+class CDProtoStream:
+    """Buffered CDProto frame stream over a (non-blocking) connection."""
+
+    def __init__(self, connection: socket, bufsize: int = 65536):
+        """Wraps a connection with a reusable receive buffer."""
+
+        self.connection = connection
+        self.bufsize = bufsize
+        self.buffer = bytearray()
+        self.closed = False
+        self.binary = False     # passa a True quando a ligação negociar o formato binário
+        self._start = 0         # início dos dados ainda por ler no buffer
+        self._pending = 0       # bytes que faltam entregar da frame atual
+
+    def fill(self) -> int:
+        """Appends whatever is available on the connection to the buffer."""
+
+        try:
+            data = self.connection.recv(self.bufsize)
+        except BlockingIOError:
+            return 0
+        except ConnectionResetError:
+            data = b""
+
+        if not data:        # o outro lado fechou a ligação
+            self.closed = True
+
+        self.feed(data)
+        return len(data)
+
+    def feed(self, data: bytes):
+        """Appends data to the buffer, dropping the frames already read (once per call, not per frame)."""
+
+        if self._start:
+            del self.buffer[:self._start]
+            self._start = 0
+        self.buffer += data
+
+    def clear(self):
+        """Drops everything buffered."""
+
+        self.buffer.clear()
+        self._start = 0
+        self._pending = 0
+
+    def has_frame(self) -> bool:
+        """Checks if there is at least one complete frame in the buffer."""
+
+        size = 4 if self.binary else 2
+        start = self._start
+        if len(self.buffer) - start < size:
+            return False
+        return len(self.buffer) - start >= size + int.from_bytes(self.buffer[start:start + size], "big")
+
+    def recv(self, size: int) -> bytes:
+        """Socket like recv, served from the buffer.
+
+        A header is only handed out when the whole frame is already buffered,
+        so CDProto.recv_msg returns None (instead of a partial frame) when
+        there is nothing complete to decode yet. An empty frame, or one longer
+        than MAX_FRAME, raises CDProtoBadFormat (as soon as its header arrives,
+        so it is never buffered), as it does in the AsyncServer.
+        """
+
+        start = self._start
+        if self._pending == 0:      # início de uma frame: só entrega o header se a frame estiver completa
+            header = 4 if self.binary else 2
+            if len(self.buffer) - start < header:
+                return b""
+            length = int.from_bytes(self.buffer[start:start + header], "big")
+            if length == 0 or length > MAX_FRAME:
+                self._start += header
+                raise CDProtoBadFormat(bytes(self.buffer[start:start + header]))
+            if len(self.buffer) - start < header + length:
+                return b""
+            self._pending = header + length
+
+        size = min(size, self._pending)
+        data = bytes(self.buffer[start:start + size])
+        self._start += size
+        self._pending -= size
+        return data
+
         
 class CDProtoBadFormat(Exception):
     """Exception when source message is not CDProto."""
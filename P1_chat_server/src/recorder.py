@@ -0,0 +1,74 @@
+"""Recording of the traffic received by a chat server, for offline replay."""
+import struct
+import time
+
+MAGIC = b"CDREC1\n"
+_EVENT = struct.Struct("!QIBI")         # microssegundos desde o início, ligação, tipo, tamanho dos dados
+
+CONNECT, DATA, CLOSE = 0, 1, 2
+
+
+class TrafficRecorder:
+    """Writes what every client sends (and when) to a compact binary file.
+
+    Each event is a 17-byte header (time, connection id, kind, size) followed
+    by the bytes received, exactly as they came from the socket.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1):
+        """path: file to write; flush_interval: maximum seconds the events wait in memory."""
+
+        self.file = open(path, "wb", buffering=1024 * 1024)
+        self.file.write(MAGIC)
+        self.start = time.monotonic()
+        self.ids = {}               # socket : id da ligação no ficheiro
+        self.next_id = 0
+        self.flush_interval = flush_interval
+        self.last_flush = self.start
+
+    def write(self, conn_id: int, kind: int, data: bytes = b""):
+        elapsed = int((time.monotonic() - self.start) * 1e6)
+        self.file.write(_EVENT.pack(elapsed, conn_id, kind, len(data)))
+        if data:
+            self.file.write(data)
+
+    def connect(self, conn):
+        self.ids[conn] = self.next_id
+        self.write(self.next_id, CONNECT)
+        self.next_id += 1
+
+    def data(self, conn, data: bytes):
+        conn_id = self.ids.get(conn)
+        if conn_id is not None:     # ligações que não foram aceites por nós (federação) não são gravadas
+            self.write(conn_id, DATA, data)
+
+    def close(self, conn):
+        conn_id = self.ids.pop(conn, None)
+        if conn_id is not None:
+            self.write(conn_id, CLOSE)
+
+    def flush(self, force: bool = False):
+        """Writes the buffered events to disk, at most once per flush_interval."""
+
+        now = time.monotonic()
+        if force or now - self.last_flush >= self.flush_interval:
+            self.file.flush()
+            self.last_flush = now
+
+
+def read_events(path: str):
+    """Yields the (seconds, connection id, kind, data) events of a recording."""
+
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a traffic recording")
+
+        while True:
+            header = f.read(_EVENT.size)
+            if len(header) < _EVENT.size:
+                return
+            elapsed, conn_id, kind, size = _EVENT.unpack(header)
+            data = f.read(size)
+            if len(data) < size:        # gravação interrompida a meio de um evento
+                return
+            yield elapsed / 1e6, conn_id, kind, data
@@ -1,22 +1,63 @@
 """CD Chat server program."""
+import json
 import logging
 import selectors
 import socket
+import time
+from collections import deque
+from itertools import islice
 
-from .protocol import CDProto, CDProtoBadFormat
+from .chanlog import LogStore
+from .federation import Federation
+from .metrics import Metrics
+from .protocol import BINARY, COMPRESS_THRESHOLD, ZLIB, CDProto, CDProtoBadFormat, CDProtoStream
+from .recorder import TrafficRecorder
+from .timers import TimerWheel
 
 logging.basicConfig(filename="server.log", level=logging.DEBUG)
 
+logger = logging.getLogger(__name__)                    # eventos: ligações, registos, joins
+msg_logger = logging.getLogger(f"{__name__}.messages")  # uma entrada por mensagem (pode ser amostrada)
+
+_IOV_MAX = 1024     # máximo de buffers num sendmsg (IOV_MAX em Linux)
+
 class Server:
     """Chat Server process."""
 
-    def __init__(self):
+    def __init__(self, host: str = 'localhost', port: int = 8080, max_queued: int = 1024 * 1024,
+                 reuse_port: bool = False, relay=None, history: int = 50, history_bytes: int = 256 * 1024,
+                 peers: list = None, idle_timeout: float = 60, ping_timeout: float = 10,
+                 read_budget: int = 32, rate: float = None, burst: int = 20,
+                 chanlog_dir: str = None, commit_interval: float = 0.05, catchup_bytes: int = 256 * 1024,
+                 compress_threshold: int = COMPRESS_THRESHOLD, record: str = None, admin_port: int = None,
+                 peer_secret: str = None):
+        """Initializes the server.
+
+        max_queued: bytes the socket of a client may leave unwritten in its outbound queue before it is disconnected
+        history: messages kept per channel with members and replayed to clients joining it (0 disables it)
+        history_bytes: maximum size of the (JSON) frames kept in the history of a channel
+        reuse_port: share (host, port) with other worker processes (SO_REUSEPORT)
+        relay: WorkerRelay used to exchange channel messages with the other workers
+        peers: "host:port" of the other servers of the federation (all of them must list each other)
+        peer_secret: secret shared by the servers of the federation, required from every peer
+        idle_timeout: seconds without receiving anything before a connection is pinged (None disables it)
+        ping_timeout: seconds to wait for any answer to the ping before the connection is evicted
+        read_budget: maximum frames processed per client in each loop iteration
+        rate: frames per second allowed per client (token bucket, None disables it)
+        burst: frames a client may send at once before the rate applies
+        chanlog_dir: directory of the durable channel logs clients can resume from (None disables them)
+        commit_interval: maximum seconds between the fsyncs of the channel logs (group commit)
+        catchup_bytes: size of each read of the log while streaming a gap to a resuming client
+        compress_threshold: payload size from which frames are compressed for clients that negotiated zlib
+        record: file where the traffic received from clients is recorded (see replay.py)
+        admin_port: local port that answers every connection with the metrics of the server (json)
+        """
   
         self.sel = selectors.DefaultSelector()
         self.sock_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
-        host = 'localhost'
-        port = 8080
+        if reuse_port:
+            self.sock_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock_server.bind((host, port))
         print("--- Server Opened ---")
 
@@ -25,64 +66,648 @@ class Server:
         self.sel.register(self.sock_server, selectors.EVENT_READ, self.accept)
 
         self.total_clients = {}     # socket : [user, [list_of_channels]] 
+        self.channels = {}          # channel : set(sockets) -> índice dos membros de cada canal
+        self.streams = {}           # socket : CDProtoStream -> buffer de receção de cada cliente
+        self.outbox = {}            # socket : deque(frames) -> frames que ainda não foram escritas no socket
+        self.queued = {}            # socket : nº de bytes em espera no outbox
+        self.binary = set()         # sockets que negociaram o formato binário no register
+        self.compressed = set()     # sockets que aceitam frames comprimidas com zlib
+        self.compress_threshold = compress_threshold
+        self.events = {}            # socket : eventos registados no selector (0 = não registado)
+        self.unflushed = set()      # sockets com frames novas nesta iteração do loop (ver flush_all)
+        self.max_queued = max_queued
+
+        self.backlog = {}           # socket : instante a partir do qual pode voltar a ser processado
+        self.buckets = {}           # socket : [tokens, instante da última atualização]
+        self.read_budget = read_budget
+        self.rate = rate
+        self.burst = burst
+
+        self.history = {}           # channel : deque(frame JSON) -> últimas mensagens de cada canal com membros
+        self.history_size = {}      # channel : nº de bytes guardados no histórico
+        self.history_len = history
+        self.history_bytes = history_bytes
+
+        self.relay = relay
+        self.relay_links = set()    # sockets do relay à espera de EVENT_WRITE
+        if relay is not None:
+            self.sel.register(relay, selectors.EVENT_READ, self.relay_read)
 
+        self.timers = TimerWheel()  # prazos de inatividade de cada ligação
+        self.last_seen = {}         # socket : instante em que recebemos dados pela última vez
+        self.pinged = set()         # sockets a quem foi enviado um ping ainda sem resposta
+        self.idle_timeout = idle_timeout
+        self.ping_timeout = ping_timeout
+
+        self.logs = None            # logs duráveis de cada canal
+        self.catchup = {}           # socket : [channel, próximo offset a enviar, offset final]
+        self.catchup_bytes = catchup_bytes
+        if chanlog_dir:
+            self.logs = LogStore(chanlog_dir, commit_interval)
+
+        self.recorder = TrafficRecorder(record) if record else None
+
+        self.metrics = Metrics()
+        self.admin = None
+        self.admin_out = {}         # socket : resto do snapshot ainda por enviar a uma ligação ao admin port
+        if admin_port is not None:      # só acessível localmente
+            self.admin = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.admin.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.admin.bind(("127.0.0.1", admin_port))
+            self.admin.listen(10)
+            self.sel.register(self.admin, selectors.EVENT_READ, self.admin_accept)
+
+        self.federation = None
+        if peers:
+            self.federation = Federation(self, f"{host}:{port}", peers, peer_secret)
         
 
     def accept(self, sock, mask):
         sock_client, addr = sock.accept()
-        print('Connected to ', addr)
-        sock_client.setblocking(False)
+        logger.info('Connected to %s', addr)
+
+        self.add_connection(sock_client)
+        if self.recorder is not None:
+            self.recorder.connect(sock_client)
+
+
+
+    def admin_accept(self, sock, mask):
+        """Answers a connection to the admin port with a snapshot of the metrics."""
+
+        conn, _ = sock.accept()
+        conn.setblocking(False)     # um leitor lento do admin port não pode parar o loop
+        self.admin_out[conn] = memoryview(json.dumps(self.metrics.snapshot(self)).encode("UTF-8") + b"\n")
+        self.sel.register(conn, selectors.EVENT_WRITE, self.admin_write)
+
+
+
+    def admin_write(self, conn, mask):
+        """Sends what the socket buffer takes of the snapshot, closing conn once it is all out."""
+
+        data = self.admin_out[conn]
+        try:
+            data = data[conn.send(data):]
+        except BlockingIOError:
+            return
+        except OSError:
+            data = data[:0]
+
+        if data:
+            self.admin_out[conn] = data
+            return
+        del self.admin_out[conn]
+        self.sel.unregister(conn)
+        conn.close()
+
+
+
+    def add_connection(self, sock):
+        """Starts serving a connected socket (a client or a federated server)."""
 
-        self.sel.register(sock_client, selectors.EVENT_READ, self.read)
-    
+        sock.setblocking(False)
+
+        self.streams[sock] = CDProtoStream(sock)
+        self.outbox[sock] = deque()
+        self.queued[sock] = 0
+        self.events[sock] = selectors.EVENT_READ
+        self.sel.register(sock, selectors.EVENT_READ, self.ready)
+
+        if self.rate:
+            self.buckets[sock] = [self.burst, time.monotonic()]
+
+        if self.idle_timeout:
+            self.last_seen[sock] = time.monotonic()
+            self.timers.schedule(sock, self.idle_timeout)
+
+
+
+    def ready(self, conn, mask):
+        """Dispatches selector events of a client connection."""
+
+        if conn not in self.streams:    # pode ter sido desligado durante esta iteração do loop
+            return
+
+        if mask & selectors.EVENT_WRITE:
+            self.flush(conn)
+
+        if mask & selectors.EVENT_READ and conn in self.streams:
+            self.read(conn, mask)
 
        
     def read(self, conn, mask):
 
-        msg = CDProto.recv_msg(conn)
+        stream = self.streams[conn]
+        received = stream.fill()
+        self.metrics.bytes_in += received
+        if received and self.idle_timeout:
+            self.last_seen[conn] = time.monotonic()     # qualquer dado recebido conta como sinal de vida
+            self.pinged.discard(conn)
+
+        if received and self.recorder is not None:
+            self.recorder.data(conn, stream.buffer[-received:])
+
+        self.process(conn, mask)
+
+
+
+    def process(self, conn, mask=selectors.EVENT_READ):
+        """Handles the buffered frames of conn, within its read budget and rate limit.
+
+        Frames left over go to the backlog and are handled in the next loop
+        iterations, so a flooding client cannot hold the loop for everyone else.
+        """
+
+        stream = self.streams[conn]
+        budget = self.read_budget
+
+        while self.has_token(conn):
+            try:
+                msg = CDProto.recv_msg(stream)
+            except CDProtoBadFormat:    # não é CDProto: a ligação é fechada, como no AsyncServer
+                logger.info('>> bad frame from %s, disconnecting', self.total_clients.get(conn, [conn.fileno()])[0])
+                self.disconnect(conn)
+                return
+            if not msg:
+                break
+
+            self.spend_token(conn)
+            self.metrics.frames_in += 1
+            try:
+                self.handle_msg(conn, mask, msg)
+            except CDProtoBadFormat:    # p.ex. uma mensagem binária que em JSON já não cabe numa frame
+                logger.info('>> oversized message from %s, disconnecting', self.total_clients.get(conn, [conn.fileno()])[0])
+                self.disconnect(conn)
+                return
+            if conn not in self.streams:    # desligado enquanto processava a mensagem
+                return
+
+            budget -= 1
+            if budget == 0:
+                break
+
+        if stream.has_frame():      # ainda há frames: fica à espera da sua vez (ou de tokens)
+            self.backlog[conn] = self.next_token(conn)
+            self.watch(conn)
+            return
+
+        if conn in self.backlog:
+            del self.backlog[conn]
+            self.watch(conn)
+
+        if stream.closed:
+            self.disconnect(conn)
+
 
-        if msg: 
-            if msg.command == "register":
-                print(f'>> {msg.user} joined the server')
-                self.total_clients[conn] = [msg.user, [None]]
 
-            elif msg.command == "join":
-                channel = msg.channel
+    def has_token(self, conn) -> bool:
+        """Checks if the token bucket of conn allows one more frame (refilling it first)."""
 
-                if channel in  self.total_clients[conn][1]: # caso o cliente volte a entrar num canal, é eliminado da lista de channels, para evitar repetições
-                    self.total_clients[conn][1].remove(channel)
+        bucket = self.buckets.get(conn)
+        if bucket is None:
+            return True
 
-                self.total_clients[conn][1].append(channel)
-                print(f'>> { self.total_clients[conn][0]} joined the channel {channel}')
+        now = time.monotonic()
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        return bucket[0] >= 1
 
-            elif msg.command == "message":
 
-                channel = msg.channel
-                broadcast_msg = f'<<{channel}>> [{self.total_clients[conn][0]}]: {msg.message}' # mensagem para enviar para todos os clientes, irá sempre mostrar o canal de onde veio essa mensagem <<[channel_name]>>
 
-                msg = CDProto.message(broadcast_msg, channel)
+    def spend_token(self, conn):
+        bucket = self.buckets.get(conn)
+        if bucket is not None:
+            bucket[0] -= 1
 
-                print(f'{broadcast_msg} | channels: {self.total_clients[conn][1]}')
 
-                self.send_broadcast_msg(conn, mask, channel, msg) # enviar a mensagem para todos os clientes
-            
-            logging.debug('received "%s', msg)
-                
+
+    def next_token(self, conn) -> float:
+        """Instant when conn may be processed again."""
+
+        bucket = self.buckets.get(conn)
+        if bucket is None or bucket[0] >= 1:
+            return time.monotonic()
+        return bucket[1] + (1 - bucket[0]) / self.rate
+
+
+
+    def watch(self, conn):
+        """Updates the selector events of conn.
+
+        Clients in the backlog are not read from until it is their turn again, so
+        their data waits in the kernel (TCP backpressure) instead of in our buffers.
+        """
+
+        events = 0
+        if conn not in self.backlog:
+            events |= selectors.EVENT_READ
+        if self.outbox[conn]:
+            events |= selectors.EVENT_WRITE
+
+        current = self.events[conn]
+        if events == current:
+            return
+
+        if not current:
+            self.sel.register(conn, events, self.ready)
+        elif not events:
+            self.sel.unregister(conn)
         else:
-            print(f'>> {self.total_clients[conn][0]} has left the server')
+            self.sel.modify(conn, events, self.ready)
+        self.events[conn] = events
+
+
+
+    def handle_msg(self, conn, mask, msg):
+        """Processes a Message received from conn."""
+
+        if msg.command == "register":
+            logger.info('>> %s joined the server', msg.user)
+            self.total_clients[conn] = [msg.user, [None]]
+            self.add_member(None, conn)
+
+            if BINARY in msg.caps:      # as próximas frames (nos dois sentidos) já vêm no formato binário
+                self.streams[conn].binary = True
+                self.binary.add(conn)
+
+            if ZLIB in msg.caps:
+                self.compressed.add(conn)
+
+        elif msg.command == "join":
+            channel = msg.channel
+
+            if channel in  self.total_clients[conn][1]: # caso o cliente volte a entrar num canal, é eliminado da lista de channels, para evitar repetições
+                self.total_clients[conn][1].remove(channel)
+
+            self.total_clients[conn][1].append(channel)
+            self.add_member(channel, conn)
+            logger.info('>> %s joined the channel %s', self.total_clients[conn][0], channel)
+
+            self.replay(conn, channel)
+
+        elif msg.command == "message" and self.federation and conn in self.federation.links:
+            # mensagem de um cliente de outro servidor: só é entregue localmente
+            frames = {}
+            self.record(msg.channel, msg, frames)
+            self.deliver(None, msg.channel, msg, frames)
+            self.remember(msg.channel, msg, frames)
+
+            if self.relay is not None:
+                self.relay.publish(frames.get(False) or CDProto.encode_msg(msg))
+
+        elif msg.command == "ping":
+            self.send(conn, CDProto.encode_msg(CDProto.pong(), conn in self.binary))
 
-            self.total_clients.pop(conn)
+        elif msg.command == "pong":
+            pass                        # a atividade já foi registada em read
+
+        elif msg.command == "resume" and self.logs is not None:
+            log = self.logs.get(msg.channel, create=False)     # um canal sem log não tem nada a repor
+            if log is not None:
+                start = log.find(msg.ts or 0) if msg.offset is None else msg.offset
+                self.catchup[conn] = [msg.channel, start, log.next_offset]     # as novas chegam em direto
+                self.catch_up(conn)
+
+        elif msg.command == "peer" and self.federation:
+            self.federation.hello(conn, msg)
+
+        elif msg.command == "interest" and self.federation and conn in self.federation.links:
+            self.federation.update(conn, msg)
+
+        elif msg.command == "message":
+
+            channel = msg.channel
+            broadcast_msg = f'<<{channel}>> [{self.total_clients[conn][0]}]: {msg.message}' # mensagem para enviar para todos os clientes, irá sempre mostrar o canal de onde veio essa mensagem <<[channel_name]>>
+
+            msg = CDProto.message(broadcast_msg, channel)
+
+            msg_logger.info('%s | channels: %s', broadcast_msg, self.total_clients[conn][1])
+
+            self.send_broadcast_msg(conn, mask, channel, msg) # enviar a mensagem para todos os clientes
+
+
+
+    def disconnect(self, conn):
+        """Removes conn from the server."""
+
+        if conn not in self.streams:    # já foi desligado
+            return
+
+        if conn in self.total_clients:
+            user, channels = self.total_clients.pop(conn)
+            logger.info('>> %s has left the server', user)
+
+            for channel in channels:       # retirar o cliente do índice de cada canal onde estava
+                self.remove_member(channel, conn)
+
+        if self.federation and conn in self.federation.links:
+            self.federation.link_down(conn)
+
+        self.streams.pop(conn, None)
+        self.outbox.pop(conn, None)
+        self.queued.pop(conn, None)
+        self.binary.discard(conn)
+        self.compressed.discard(conn)
+        self.timers.cancel(conn)
+        self.last_seen.pop(conn, None)
+        self.pinged.discard(conn)
+        self.backlog.pop(conn, None)
+        self.buckets.pop(conn, None)
+        self.catchup.pop(conn, None)
+        self.unflushed.discard(conn)
+        if self.recorder is not None:
+            self.recorder.close(conn)
+        if self.events.pop(conn):
             self.sel.unregister(conn)
-            
-            conn.close()
+        
+        conn.close()
+
+
+    def check_idle(self, conn):
+        """Called when the idle timer of conn expires: pings it or evicts it."""
+
+        if conn not in self.streams:
+            return
+
+        if conn in self.pinged:         # nada recebido desde o ping: ligação morta
+            logger.info('>> evicting idle connection %s', self.total_clients.get(conn, [conn])[0])
+            self.disconnect(conn)
+            return
+
+        idle = time.monotonic() - self.last_seen[conn]
+        if idle < self.idle_timeout:    # houve atividade entretanto: esperar o tempo que falta
+            self.timers.schedule(conn, self.idle_timeout - idle)
+            return
+
+        self.pinged.add(conn)
+        self.timers.schedule(conn, self.ping_timeout)
+        self.send(conn, CDProto.encode_msg(CDProto.ping(), conn in self.binary))
+
+
+
+    def add_member(self, channel, conn):
+        """Adds conn to the members index of channel."""
+
+        members = self.channels.get(channel)
+        if members is None:
+            members = self.channels[channel] = set()
+            if self.federation:             # primeiro membro local: os outros servidores passam a enviar-nos o canal
+                self.federation.channel_changed(channel, True)
+
+        members.add(conn)
+
+
+
+    def remove_member(self, channel, conn):
+        """Removes conn from the members index of channel."""
+
+        members = self.channels.get(channel)
+        if members is not None:
+            members.discard(conn)
+            if not members:
+                del self.channels[channel]
+                self.history.pop(channel, None)     # ninguém o vai pedir: só os canais com membros têm histórico
+                self.history_size.pop(channel, None)
+                if self.federation:
+                    self.federation.channel_changed(channel, False)
+
 
 
     def send_broadcast_msg(self, conn, mask, channel, msg):
         '''Função para enviar as TextMessages para todos os clientes'''
 
-        for sock in self.total_clients.keys(): 
-            if sock != conn and channel in self.total_clients[sock][1]:     # a ultima posicao do vetor dos channels corresponde ao channel em que o client se encontra atualmente
-                CDProto.send_msg(sock, msg)                                 # irá imprimir a mensagem se esta pertecer a um canal a que o cliente perteça
+        frames = {}                         # a mensagem é serializada uma única vez por formato
+        self.record(channel, msg, frames)
+        if False not in frames:
+            frames[False] = CDProto.encode_msg(msg)
+
+        self.deliver(conn, channel, msg, frames)
+        self.remember(channel, msg, frames)
+
+        if self.relay is not None:          # os membros do canal ligados a outros workers
+            self.relay.publish(frames[False])
+
+        if self.federation:                 # os servidores com membros neste canal
+            self.federation.forward(channel, frames[False])
+
+
+
+    def relay_read(self, relay, mask):
+        """Delivers the frames published by other workers to the local channel members."""
+
+        frame = relay.recv()
+        while frame:            # todas as pendentes: a fila de datagramas de um socket unix é curta
+            msg = CDProto.decode_msg(frame[2:])
+            frames = {False: frame}
+            self.record(msg.channel, msg, frames)
+            self.deliver(None, msg.channel, msg, frames)
+            self.remember(msg.channel, msg, frames)
+            frame = relay.recv()
+
+
+
+    def relay_write(self, link, mask):
+        """Sends the frames that were waiting for room in another worker."""
+
+        self.relay.flush(link)
+
+
+
+    def watch_relay(self):
+        """Waits for EVENT_WRITE only on the relay sockets with frames waiting."""
+
+        waiting = self.relay.waiting()
+        for link in waiting - self.relay_links:
+            self.sel.register(link, selectors.EVENT_WRITE, self.relay_write)
+        for link in self.relay_links - waiting:
+            self.sel.unregister(link)
+        self.relay_links = waiting
+
+
+
+    def record(self, channel, msg, frames):
+        """Appends msg to the durable log of channel, stamping it with its offset there."""
+
+        if self.logs is None:
+            return
+
+        log = self.logs.get(channel)
+        msg.offset = log.next_offset
+        frames.clear()                      # a frame tem de levar o offset deste servidor
+        frames[False] = CDProto.encode_msg(msg)
+        self.logs.append(channel, frames[False], msg.ts)
+
+
+
+    def catch_up(self, conn):
+        """Streams to conn the part of a channel log it asked for with a resume.
+
+        The gap is read from the log in chunks of catchup_bytes, and the next
+        chunk is only read when the previous one left the outbound queue, so a
+        long gap never goes over max_queued.
+        """
+
+        while conn in self.catchup and not self.outbox[conn]:
+            channel, offset, end = self.catchup[conn]
+            frames, offset = self.logs.get(channel).read(offset, self.catchup_bytes, end)
+
+            binary = conn in self.binary
+            if binary:
+                frames = [CDProto.encode_msg(CDProto.decode_msg(bytes(frame[2:])), True) for frame in frames]
+            if conn in self.compressed:
+                frames = [CDProto.compress(frame, binary, self.compress_threshold) for frame in frames]
+            batch = b"".join(frames)
+            del frames              # liberta as views sobre o mmap do segmento
+
+            if offset >= end or not batch:
+                del self.catchup[conn]
+            else:
+                self.catchup[conn][1] = offset
+
+            if batch:
+                self.send(conn, batch)
+
+
+
+    def remember(self, channel, msg, frames):
+        """Appends msg to the history ring buffer of channel (if it has members here)."""
+
+        if self.history_len <= 0 or channel not in self.channels:
+            return
+
+        ring = self.history.get(channel)
+        if ring is None:
+            ring = self.history[channel] = deque(maxlen=self.history_len)
+            self.history_size[channel] = 0
+
+        if len(ring) == ring.maxlen:        # a mensagem mais antiga vai ser descartada pelo deque
+            self.history_size[channel] -= len(ring[0])
+
+        frame = frames.get(False)           # só a frame JSON: as outras refazem-se no replay
+        if frame is None:
+            frame = frames[False] = CDProto.encode_msg(msg)
+        ring.append(frame)
+        self.history_size[channel] += len(frame)
+
+        while self.history_size[channel] > self.history_bytes and len(ring) > 1:
+            self.history_size[channel] -= len(ring.popleft())
+
+
+
+    def replay(self, conn, channel):
+        """Sends the history of channel to conn in a single write."""
+
+        ring = self.history.get(channel)
+        if not ring:
+            return
+
+        binary = conn in self.binary
+        batch = [self.frame_for(conn, CDProto.decode_msg(frame[2:]) if binary else None, {False: frame})
+                 for frame in ring]
+        self.send(conn, b"".join(batch))
+
+
+
+    def frame_for(self, conn, msg, frames):
+        """Frame of msg in the format negotiated by conn.
+
+        frames caches the encoded frame of msg per format: binary or not, and
+        compressed or not, so each one is built once per broadcast.
+        """
+
+        binary = conn in self.binary
+        frame = frames.get(binary)
+        if frame is None:
+            frame = frames[binary] = CDProto.encode_msg(msg, binary)
+
+        if conn in self.compressed:
+            packed = frames.get((binary, ZLIB))
+            if packed is None:
+                packed = frames[(binary, ZLIB)] = CDProto.compress(frame, binary, self.compress_threshold)
+            frame = packed
+
+        return frame
+
+
+
+    def deliver(self, conn, channel, msg, frames):
+        """Sends msg to the local members of channel (except conn)."""
+
+        for sock in self.channels.get(channel, ()):     # apenas os membros do canal são percorridos
+            if sock != conn:
+                self.send(sock, self.frame_for(sock, msg, frames))
+
+
+
+    def send(self, conn, frame):
+        """Queues frame to be written to conn at the end of the current loop iteration.
+
+        max_queued is only checked by flush, after the write: a client that reads
+        fast may get more than that in a single iteration.
+        """
+
+        self.metrics.frames_out += 1
+        self.metrics.bytes_out += len(frame)
+
+        self.outbox[conn].append(frame)
+        self.queued[conn] += len(frame)
+        self.unflushed.add(conn)
+
+
+
+    def flush(self, conn):
+        """Writes as much of the outbound queue of conn as the socket accepts.
+
+        The queued frames go out together in a single sendmsg (scatter-gather),
+        so every frame a client got during one loop iteration costs one syscall.
+        """
+
+        queue = self.outbox[conn]
+        while queue:
+            batch = list(islice(queue, _IOV_MAX))
+            try:
+                sent = conn.sendmsg(batch)
+            except BlockingIOError:
+                break
+            except OSError:
+                self.disconnect(conn)
+                return
+
+            self.queued[conn] -= sent
+            full = sent < sum(map(len, batch))      # o socket não aceitou tudo
+
+            while sent:             # retirar da fila o que já foi escrito
+                frame = queue[0]
+                if sent < len(frame):
+                    queue[0] = memoryview(frame)[sent:]
+                    break
+                sent -= len(frame)
+                queue.popleft()
+
+            if full:
+                break
+
+            if not queue and conn in self.catchup:     # fila vazia: a próxima parte do log em falta
+                self.catch_up(conn)
+                if conn not in self.streams:
+                    return
+
+        if self.queued[conn] > self.max_queued:    # só conta o que o socket recusou
+            self.disconnect(conn)
+            return
+
+        self.watch(conn)        # esperar por EVENT_WRITE só enquanto houver frames por escrever
+
+
+
+    def flush_all(self):
+        """Flushes every connection that got frames during this loop iteration."""
+
+        while self.unflushed:
+            pending, self.unflushed = self.unflushed, set()
+            for conn in pending:
+                if conn in self.streams:
+                    self.flush(conn)
 
 
 
@@ -90,7 +715,48 @@ class Server:
         """Loop indefinetely."""
 
         while True:
-            events = self.sel.select()
+            timeout = self.timers.timeout()
+            if self.federation and self.federation.pending:
+                wait = max(0, self.federation.next_dial - time.monotonic())
+                timeout = wait if timeout is None else min(timeout, wait)
+            if self.backlog:
+                wait = max(0, min(self.backlog.values()) - time.monotonic())
+                timeout = wait if timeout is None else min(timeout, wait)
+            if self.logs is not None and self.logs.dirty:
+                wait = self.logs.timeout()
+                timeout = wait if timeout is None else min(timeout, wait)
+
+            events = self.sel.select(timeout)
+            turn = started = time.perf_counter()
             for key, mask in events:
                 callback = key.data
-                callback(key.fileobj, mask)
\ No newline at end of file
+                callback(key.fileobj, mask)
+                now = time.perf_counter()
+                self.metrics.callback_time.observe(now - started)
+                started = now
+
+            if self.backlog:        # uma vez por iteração, cada cliente com frames em espera tem a sua vez
+                now = time.monotonic()
+                for conn in [conn for conn, due in self.backlog.items() if due <= now]:
+                    if conn in self.streams:
+                        self.process(conn)
+
+            if self.recorder is not None:
+                self.recorder.flush()
+
+            if self.relay is not None:
+                self.watch_relay()
+
+            if self.logs is not None:   # group commit: um fsync por canal para todas as mensagens recentes
+                self.logs.commit()
+
+            for conn in self.timers.advance():
+                self.check_idle(conn)
+
+            if self.federation and self.federation.pending:
+                self.federation.dial()
+
+            self.flush_all()        # uma escrita por destinatário, com tudo o que recebeu nesta iteração
+
+            self.metrics.loop_time.observe(time.perf_counter() - turn)
+            self.metrics.tick(time.monotonic())
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""Headless chat clients: many sessions driven by one selector loop."""
+import selectors
+import socket
+import time
+
+from .protocol import BINARY, ZLIB, CDProto, CDProtoStream, TextMessage
+
+
+class Session:
+    """One registered user of a SessionPool."""
+
+    def __init__(self, pool, name: str, binary: bool = False, compress: bool = False, on_message=None):
+        self.pool = pool
+        self.name = name
+        self.binary = binary
+        self.on_message = on_message    # callback(session, msg) das TextMessages recebidas
+        self.channel = None             # canal para onde vão as mensagens enviadas sem canal
+        self.offsets = {}               # channel : offset da próxima mensagem ainda não vista
+        self.closed = False
+
+        self.sock = socket.create_connection(pool.address)
+        self.sock.setblocking(False)
+        self.stream = CDProtoStream(self.sock)
+        self.outbox = bytearray()       # bytes que o socket ainda não aceitou
+        pool.sel.register(self.sock, selectors.EVENT_READ, self)
+
+        caps = [BINARY] if binary else []
+        if compress:
+            caps.append(ZLIB)
+        self.write(CDProto.encode_msg(CDProto.register(name, caps)))
+        self.stream.binary = binary     # depois do register, tudo segue no formato negociado
+
+    def join(self, channel: str):
+        """Joins channel, which becomes the default channel of send."""
+
+        self.channel = channel
+        self.write(CDProto.encode_msg(CDProto.join(channel), self.binary))
+
+    def send(self, text: str, channel: str = None):
+        """Sends a message to channel (or to the last joined channel)."""
+
+        msg = CDProto.message(text, channel or self.channel)
+        self.write(CDProto.encode_msg(msg, self.binary))
+
+    def resume(self, channel: str, offset: int = None):
+        """Asks for the messages of channel from offset onwards (by default, the ones not seen yet)."""
+
+        if offset is None:
+            offset = self.offsets.get(channel, 0)
+        self.write(CDProto.encode_msg(CDProto.resume(channel, offset), self.binary))
+
+    def write(self, frame: bytes):
+        if self.closed:
+            return
+        if not self.outbox:         # nada em espera: tentar escrever logo
+            try:
+                sent = self.sock.send(frame)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self.close()
+                return
+            if sent == len(frame):
+                return
+            frame = frame[sent:]
+            self.pool.watch(self, True)
+        self.outbox += frame
+
+    def flush(self):
+        try:
+            sent = self.sock.send(self.outbox)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.close()
+            return
+
+        del self.outbox[:sent]
+        if not self.outbox:
+            self.pool.watch(self, False)
+
+    def read(self):
+        self.stream.fill()
+
+        msg = CDProto.recv_msg(self.stream)
+        while msg:
+            if type(msg) is TextMessage:
+                if msg.offset is not None:
+                    self.offsets[msg.channel] = max(self.offsets.get(msg.channel, 0), msg.offset + 1)
+                callback = self.on_message or self.pool.on_message
+                if callback is not None:
+                    callback(self, msg)
+
+            elif msg.command == "ping":     # o servidor quer saber se ainda estamos ligados
+                self.write(CDProto.encode_msg(CDProto.pong(), self.binary))
+
+            msg = CDProto.recv_msg(self.stream)
+
+        if self.stream.closed:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.pool.remove(self)
+            self.sock.close()
+
+
+class SessionPool:
+    """Runs many chat sessions on one selector, in the calling thread.
+
+    Nothing happens in the background: messages are read, callbacks called
+    and pending writes flushed only inside poll() and run().
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 8080, on_message=None):
+        """on_message: default callback(session, msg) for the sessions created without one."""
+
+        self.address = (host, port)
+        self.on_message = on_message
+        self.sel = selectors.DefaultSelector()
+        self.sessions = []
+
+    def connect(self, name: str, binary: bool = False, compress: bool = False, on_message=None) -> Session:
+        """Opens and registers a new session."""
+
+        session = Session(self, name, binary, compress, on_message)
+        self.sessions.append(session)
+        return session
+
+    def watch(self, session: Session, writing: bool):
+        """Starts (or stops) waiting for session to accept more data."""
+
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+        self.sel.modify(session.sock, events, session)
+
+    def remove(self, session: Session):
+        self.sel.unregister(session.sock)
+        if session in self.sessions:        # pode falhar ainda dentro de connect
+            self.sessions.remove(session)
+
+    def poll(self, timeout: float = 0):
+        """Handles the events that are ready (waiting at most timeout seconds)."""
+
+        for key, mask in self.sel.select(timeout):
+            session = key.data
+            if mask & selectors.EVENT_WRITE:
+                session.flush()
+            if mask & selectors.EVENT_READ and not session.closed:
+                session.read()
+
+    def run(self, duration: float = None, until=None):
+        """Polls for duration seconds (forever when None), or until until() is true."""
+
+        end = None if duration is None else time.monotonic() + duration
+        while self.sessions and not (until and until()):
+            timeout = 0.1 if end is None else min(0.1, end - time.monotonic())
+            if timeout < 0:
+                return
+            self.poll(timeout)
+
+    def close(self):
+        for session in list(self.sessions):
+            session.close()
@@ -0,0 +1,73 @@
+"""Hashed timer wheel used by the chat server to track connection deadlines."""
+import math
+import time
+
+
+class TimerWheel:
+    """Hashed timer wheel.
+
+    Timers are kept in slots tick seconds apart, so scheduling and cancelling
+    are O(1) and each tick only looks at the timers of one slot. Timers further
+    away than a full turn of the wheel carry the number of turns still to wait.
+    """
+
+    def __init__(self, tick: float = 0.5, slots: int = 256, clock=time.monotonic):
+        self.tick = tick
+        self.clock = clock
+        self.slots = [{} for _ in range(slots)]    # key : voltas que ainda faltam
+        self.where = {}                             # key : índice do slot onde está
+        self.current = 0
+        self.last = clock()                         # instante do último tick
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, key):
+        return key in self.where
+
+    def schedule(self, key, delay: float):
+        """(Re)schedules key to expire after delay seconds."""
+
+        if key in self.where:
+            self.cancel(key)
+        elif not self.where:        # roda vazia: alinhar os ticks com o instante atual
+            self.last = self.clock()
+
+        ticks = max(1, math.ceil(delay / self.tick))
+        index = (self.current + ticks) % len(self.slots)
+        self.slots[index][key] = (ticks - 1) // len(self.slots)
+        self.where[key] = index
+
+    def cancel(self, key):
+        """Removes the timer of key, if any."""
+
+        index = self.where.pop(key, None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def timeout(self):
+        """Seconds until the next tick (None when there are no timers), for select()."""
+
+        if not self.where:
+            return None
+        return max(0, self.last + self.tick - self.clock())
+
+    def advance(self) -> list:
+        """Runs the ticks that are due and returns the keys that expired."""
+
+        expired = []
+        now = self.clock()
+        while now - self.last >= self.tick:
+            self.last += self.tick
+            self.current = (self.current + 1) % len(self.slots)
+
+            slot = self.slots[self.current]
+            for key, rounds in list(slot.items()):
+                if rounds == 0:
+                    del slot[key]
+                    del self.where[key]
+                    expired.append(key)
+                else:
+                    slot[key] = rounds - 1
+
+        return expired
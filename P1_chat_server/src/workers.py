@@ -0,0 +1,186 @@
+"""Multi-process chat server: SO_REUSEPORT workers and the relay between them."""
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import traceback
+from collections import deque
+
+from .logs import setup_logging
+from .server import Server
+
+
+class WorkerRelay:
+    """Unix datagram relay that forwards channel frames between server workers.
+
+    Each worker has one socket connected to every other worker. A frame that
+    does not fit in the receive queue of a worker waits in its pending queue
+    until the socket is writable again (see Server.relay_write), so a burst
+    is delayed instead of lost.
+    """
+
+    def __init__(self, directory: str, index: int, workers: int, max_pending: int = 65536):
+        """Binds the relay socket of worker index (out of workers) inside directory.
+
+        max_pending: frames that may wait for one worker before new ones are dropped
+        """
+
+        self.index = index
+        self.paths = [os.path.join(directory, f"worker-{i}.sock") for i in range(workers)]
+        self.max_pending = max_pending
+        self.links = {}         # índice : socket ligado ao worker
+        self.pending = {}       # socket ligado : deque de frames à espera de espaço no outro worker
+        self.dropped = 0        # frames perdidos (worker parado, ou com max_pending frames em espera)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.paths[index])
+        self.sock.setblocking(False)
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def link(self, i: int):
+        """Socket connected to worker i (None while it is not running)."""
+
+        sock = self.links.get(i)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            try:
+                sock.connect(self.paths[i])
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                return None
+            self.links[i] = sock
+            self.pending[sock] = deque()
+        return sock
+
+    def publish(self, frame: bytes):
+        """Sends an encoded frame to every other worker (queuing it for the ones that are full)."""
+
+        for i in range(len(self.paths)):
+            if i == self.index:
+                continue
+
+            sock = self.link(i)
+            if sock is None or len(self.pending[sock]) >= self.max_pending:
+                self.dropped += 1
+                logging.warning("relay: frame dropped for worker %d", i)
+                continue
+
+            self.pending[sock].append(frame)
+            self.flush(sock)
+
+    def flush(self, sock):
+        """Sends the frames waiting for the worker of sock until its receive queue is full."""
+
+        queue = self.pending[sock]
+        while queue:
+            try:
+                sock.send(queue[0])
+            except BlockingIOError:
+                # nunca bloquear o loop à espera de outro worker (evita deadlocks entre workers)
+                return
+            except (FileNotFoundError, ConnectionRefusedError):     # o worker terminou
+                self.dropped += len(queue)
+                logging.warning("relay: %d frames dropped for a stopped worker", len(queue))
+                queue.clear()
+                return
+            queue.popleft()
+
+    def waiting(self) -> set:
+        """Sockets with frames waiting for room in the other worker."""
+
+        return {sock for sock, queue in self.pending.items() if queue}
+
+    def recv(self) -> bytes:
+        """Retrieves a frame published by another worker (None if nothing is pending)."""
+
+        try:
+            return self.sock.recv(65536 + 2)
+        except BlockingIOError:
+            return None
+
+    def close(self):
+        for sock in self.links.values():
+            sock.close()
+        self.sock.close()
+
+
+def run_worker(directory: str, index: int, workers: int, host: str, port: int, log_options: dict, options: dict) -> int:
+    """Body of worker index: serves until the loop stops and returns the exit code of the process."""
+
+    writer = None
+    code = 0
+    try:
+        if log_options is not None:
+            writer = setup_logging(**log_options)
+        relay = WorkerRelay(directory, index, workers)
+        if options.get("admin_port") is not None:
+            options["admin_port"] += index
+        server = Server(host=host, port=port, reuse_port=True, relay=relay, **options)
+        server.loop()
+    except KeyboardInterrupt:
+        pass
+    except BaseException:
+        code = 1
+        logging.exception("worker %d crashed", index)
+        traceback.print_exc()
+    finally:
+        # os._exit não corre o atexit: escrever aqui o que ainda está em fila
+        if writer is not None:
+            writer.stop()
+        logging.shutdown()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return code
+
+
+def run_workers(workers: int, host: str = 'localhost', port: int = 8080, log_options: dict = None, **options):
+    """Forks workers chat servers sharing (host, port) through SO_REUSEPORT.
+
+    log_options are given to setup_logging inside each worker (the queued log
+    writer thread does not survive a fork) and options are passed on to every Server.
+    With an admin_port, worker i serves its metrics on admin_port + i.
+    Returns 0, or the exit code of a worker that failed.
+    """
+
+    directory = tempfile.mkdtemp(prefix="cd-chat-")
+    pids = []
+
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:    # processo filho: um Server completo com o seu relay
+            os._exit(run_worker(directory, index, workers, host, port, log_options, options))
+
+        pids.append(pid)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)     # só no processo pai (os workers já foram criados)
+
+    failed = 0
+    try:
+        for pid in pids:
+            _, status = os.waitpid(pid, 0)
+            code = os.waitstatus_to_exitcode(status)
+            if code:
+                logging.error("worker %d exited with code %d", pid, code)
+                failed = max(failed, abs(code))
+    except KeyboardInterrupt:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    finally:
+        for index in range(workers):
+            path = os.path.join(directory, f"worker-{index}.sock")
+            if os.path.exists(path):
+                os.unlink(path)
+        os.rmdir(directory)
+
+    return failed
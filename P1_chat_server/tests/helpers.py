@@ -0,0 +1,63 @@
+"""Helpers shared by the tests that run a selector server in a thread."""
+import socket
+import threading
+import time
+
+from src.protocol import CDProto, CDProtoStream
+from src.server import Server
+
+
+def start(**options):
+    """Server on a free port (without history, unless given), looping in a daemon thread; returns it and its port."""
+
+    options.setdefault("history", 0)
+    server = Server(port=0, **options)
+    threading.Thread(target=server.loop, daemon=True).start()
+    return server, server.sock_server.getsockname()[1]
+
+
+def connect(port, user):
+    sock = socket.create_connection(("localhost", port))
+    CDProto.send_msg(sock, CDProto.register(user))
+    return sock
+
+
+def recv_all(sock, seconds):
+    """Messages received during the next seconds."""
+
+    stream = CDProtoStream(sock)
+    sock.settimeout(0.05)
+    msgs = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        try:
+            stream.fill()
+        except socket.timeout:
+            continue
+        msg = CDProto.recv_msg(stream)
+        while msg:
+            msgs.append(msg)
+            msg = CDProto.recv_msg(stream)
+    return msgs
+
+
+def closed(sock) -> bool:
+    """Checks that the server closed sock (with a reset, if it left data unread)."""
+
+    sock.settimeout(1)
+    try:
+        return sock.recv(1) == b""
+    except ConnectionResetError:
+        return True
+
+
+def free_ports(count):
+    """count local ports free right now (all bound at once, so they are different)."""
+
+    probes = [socket.socket() for _ in range(count)]
+    for probe in probes:
+        probe.bind(("127.0.0.1", 0))
+    ports = [probe.getsockname()[1] for probe in probes]
+    for probe in probes:
+        probe.close()
+    return ports
@@ -0,0 +1,76 @@
+"""Tests for the asyncio chat server."""
+import asyncio
+
+from src.async_server import AsyncServer
+from src.protocol import BINARY, CDProto, TextMessage
+
+
+async def connect(port, user):
+    reader, writer = await asyncio.open_connection("localhost", port)
+    writer.write(CDProto.encode_msg(CDProto.register(user)))
+    return reader, writer
+
+
+async def recv(reader):
+    header = int.from_bytes(await reader.readexactly(2), "big")
+    return CDProto.decode_msg(await reader.readexactly(header))
+
+
+def test_async_broadcast():
+    async def scenario():
+        server = AsyncServer(port=0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+
+        foo_r, foo_w = await connect(port, "Foo")
+        bar_r, bar_w = await connect(port, "Bar")
+        await asyncio.sleep(0.1)
+
+        foo_w.write(CDProto.encode_msg(CDProto.message("Olá Mundo")))
+        msg = await asyncio.wait_for(recv(bar_r), 2)
+        assert isinstance(msg, TextMessage)
+        assert "Olá Mundo" in msg.message
+
+        # Bar muda de canal e deixa de receber mensagens do canal por omissão
+        bar_w.write(CDProto.encode_msg(CDProto.join("#cd")))
+        await asyncio.sleep(0.1)
+        assert server.channels["#cd"] == {w for w in server.total_clients if server.total_clients[w][0] == "Bar"}
+
+        foo_w.close()
+        bar_w.close()
+        await asyncio.sleep(0.1)
+        assert server.total_clients == {}
+        assert server.channels == {}
+
+        server.server.close()
+        await server.server.wait_closed()
+
+    asyncio.run(scenario())
+
+
+def test_async_oversized_message():
+    async def scenario():
+        server = AsyncServer(port=0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("localhost", port)
+        writer.write(CDProto.encode_msg(CDProto.register("big", [BINARY])))
+        foo_r, foo_w = await connect(port, "Foo")
+        await asyncio.sleep(0.1)
+
+        writer.write(CDProto.encode_msg(CDProto.message("é" * 30000), True))    # em JSON não cabe
+        assert await asyncio.wait_for(reader.read(), 2) == b""      # ligação fechada pelo servidor
+
+        bar_r, bar_w = await connect(port, "Bar")
+        await asyncio.sleep(0.1)
+        bar_w.write(CDProto.encode_msg(CDProto.message("still here")))
+        msg = await asyncio.wait_for(recv(foo_r), 2)
+        assert msg.message == "<<None>> [Bar]: still here"
+
+        for w in (writer, foo_w, bar_w):
+            w.close()
+        server.server.close()
+        await server.server.wait_closed()
+
+    asyncio.run(scenario())
@@ -0,0 +1,122 @@
+"""Tests the durable channel logs and resuming from them."""
+import os
+import socket
+import time
+
+from src.chanlog import _RECORD, ChannelLog, LogStore
+from src.protocol import CDProto
+
+from tests.helpers import recv_all, start
+
+
+def test_append_read(tmp_path):
+    log = ChannelLog(str(tmp_path), segment_bytes=100)
+    for i in range(20):
+        assert log.append(f"frame {i}".encode(), 1000 + i // 5) == i
+
+    assert len(log.segments) > 1        # cada segmento leva poucos registos
+    frames, offset = log.read(3)
+    assert [bytes(f) for f in frames] == [f"frame {i}".encode() for i in range(3, 20)]
+    assert offset == 20
+
+    frames, offset = log.read(0, max_bytes=14)
+    assert len(frames) == 2 and offset == 2
+    frames, offset = log.read(5, end=7)
+    assert [bytes(f) for f in frames] == [b"frame 5", b"frame 6"]
+    del frames
+
+    assert log.find(1002) == 10
+    assert log.find(2000) == 20
+
+
+def test_roll_durable(tmp_path):
+    log = ChannelLog(str(tmp_path), segment_bytes=100)
+    for i in range(10):
+        log.append(f"frame {i}".encode(), i)
+
+    old = log.segments[0]
+    assert len(log.segments) > 1 and old.file is None
+    with open(old.path, "rb") as f:     # sem sync(): o segmento anterior já tem de estar todo no ficheiro
+        data = f.read()
+    assert len(data) == old.size
+    frames, pos = [], 0
+    while pos < len(data):
+        length, ts = _RECORD.unpack_from(data, pos)
+        frames.append((data[pos + _RECORD.size:pos + _RECORD.size + length], ts))
+        pos += _RECORD.size + length
+    assert frames == [(f"frame {i}".encode(), i) for i in range(len(old))]
+    log.close()
+
+
+def test_reopen(tmp_path):
+    store = LogStore(str(tmp_path), commit_interval=0)
+    for i in range(5):
+        store.append("#cd", f"frame {i}".encode(), i)
+    store.close()
+
+    with open(tmp_path / "#cd".encode().hex() / f"{0:020d}.log", "ab") as f:
+        f.write(b"\x00\x00\x00\x10torn")         # registo escrito a meio antes de um crash
+
+    log = LogStore(str(tmp_path)).get("#cd")
+    assert log.next_offset == 5
+    assert log.append(b"frame 5", 5) == 5
+    frames, _ = log.read(4)
+    assert [bytes(f) for f in frames] == [b"frame 4", b"frame 5"]
+
+
+def test_store_limits(tmp_path):
+    store = LogStore(str(tmp_path), max_open=2)
+    channels = ["#" + "x" * 200, "#a", "#b", "#c"]      # o primeiro não cabe num nome de ficheiro em hex
+    for i, channel in enumerate(channels):
+        store.append(channel, f"frame {i}".encode(), i)
+
+    assert len(store.logs) == 2
+    assert all(len(name) <= 128 for name in os.listdir(tmp_path))
+    for i, channel in enumerate(channels):      # os logs fechados para abrir outros voltam a abrir-se
+        frames, _ = store.get(channel).read(0)
+        assert [bytes(f) for f in frames] == [f"frame {i}".encode()]
+        del frames
+
+    assert store.get("#nobody", create=False) is None
+    assert len(os.listdir(tmp_path)) == 4
+    store.close()
+
+
+def test_resume(tmp_path):
+    server, port = start(chanlog_dir=str(tmp_path), catchup_bytes=512)
+
+    sender = socket.create_connection(("localhost", port))
+    CDProto.send_msg(sender, CDProto.register("sender"))
+    CDProto.send_msg(sender, CDProto.join("#cd"))
+    sender.sendall(b"".join(CDProto.encode_msg(CDProto.message(f"msg {i}", "#cd")) for i in range(100)))
+    time.sleep(0.3)
+
+    late = socket.create_connection(("localhost", port))
+    CDProto.send_msg(late, CDProto.register("late"))
+    CDProto.send_msg(late, CDProto.resume("#cd", 40))
+    msgs = recv_all(late, 0.5)
+
+    # o resto do log chega em várias leituras de catchup_bytes, por ordem
+    assert [msg.offset for msg in msgs] == list(range(40, 100))
+    assert msgs[0].message == "<<#cd>> [sender]: msg 40"
+
+    by_ts = socket.create_connection(("localhost", port))
+    CDProto.send_msg(by_ts, CDProto.register("by_ts"))
+    CDProto.send_msg(by_ts, CDProto.resume("#cd", ts=msgs[0].ts))
+    assert recv_all(by_ts, 0.3)[-1].offset == 99
+
+    bad = socket.create_connection(("localhost", port))
+    CDProto.send_msg(bad, CDProto.register("bad"))
+    payload = b'{"command": "resume", "channel": "#cd", "offset": "0"}'
+    bad.sendall(len(payload).to_bytes(2, "big") + payload)
+    bad.settimeout(1)
+    assert bad.recv(1) == b""                   # desligado, e o servidor continua a responder
+    CDProto.send_msg(late, CDProto.resume("#cd", 99))
+    assert [msg.offset for msg in recv_all(late, 0.3)] == [99]
+
+    long = "#" + "y" * 200
+    CDProto.send_msg(sender, CDProto.join(long))
+    CDProto.send_msg(sender, CDProto.message("long", long))
+    CDProto.send_msg(late, CDProto.resume("#none", 0))        # sem log: não cria nenhum
+    time.sleep(0.2)
+    assert sorted(server.logs.logs) == sorted(["#cd", long])
@@ -0,0 +1,56 @@
+"""Microbenchmarks of the CDProto codec.
+
+The floors are several times below what a laptop does, so they only fail
+when a change makes encoding or decoding much slower (a regression in the
+hot path of every broadcast), not because of a noisy machine.
+"""
+import time
+
+import pytest
+
+from src.protocol import CDProto
+
+MSG = CDProto.message("<<#cd>> [bot1]: hello there, how are you?", "#cd")
+
+
+def rate(func, seconds=0.2):
+    """Calls per second of func."""
+
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _ in range(1000):
+            func()
+        calls += 1000
+    return calls / (time.perf_counter() - start)
+
+
+def test_slots():
+    for msg in (MSG, CDProto.join("#cd"), CDProto.register("bot", ["binary"]), CDProto.ping()):
+        assert not hasattr(msg, "__dict__")
+
+    with pytest.raises(AttributeError):
+        MSG.extra = 1
+
+
+@pytest.mark.parametrize("binary, floor", [(False, 40_000), (True, 150_000)])
+def test_encode_rate(binary, floor):
+    assert rate(lambda: CDProto.encode_msg(MSG, binary)) > floor
+
+
+@pytest.mark.parametrize("binary, floor", [(False, 40_000), (True, 100_000)])
+def test_decode_rate(binary, floor):
+    payload = CDProto.encode_msg(MSG, binary)[4 if binary else 2:]
+    assert rate(lambda: CDProto.decode_msg(payload, binary)) > floor
+
+
+def test_roundtrip():
+    for binary in (False, True):
+        size = 4 if binary else 2
+        for msg in (MSG, CDProto.join("#cd"), CDProto.register("bot"), CDProto.resume("#cd", 3)):
+            decoded = CDProto.decode_msg(CDProto.encode_msg(msg, binary)[size:], binary)
+            assert type(decoded) is type(msg) and str(decoded) == str(msg)
+
+    msg = CDProto.decode_msg(CDProto.encode_msg(CDProto.peer("localhost:8080"))[2:])
+    assert msg.node == "localhost:8080"
+    assert CDProto.decode_msg(b'{"command": "unknown"}') is None
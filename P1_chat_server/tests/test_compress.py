@@ -0,0 +1,55 @@
+"""Tests the zlib compression of large frames."""
+import socket
+import time
+
+import pytest
+
+from src.protocol import BINARY, ZLIB, CDProto, CDProtoBadFormat, CDProtoStream
+
+from tests.helpers import start
+
+CODE = "    for sock in self.channels.get(channel, ()):\n" * 100
+
+
+def test_compress():
+    for binary in (False, True):
+        size = 4 if binary else 2
+        frame = CDProto.encode_msg(CDProto.message(CODE, "#cd"), binary)
+        packed = CDProto.compress(frame, binary)
+
+        assert len(packed) < len(frame) / 10
+        assert int.from_bytes(packed[:size], "big") == len(packed) - size
+        assert CDProto.decode_msg(packed[size:], binary).message == CODE
+
+    small = CDProto.encode_msg(CDProto.message("Hi"))
+    assert CDProto.compress(small) is small      # abaixo do limite fica como está
+
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.decode_msg(b"x\x9cnot zlib")
+
+
+def test_broadcast():
+    _, port = start()
+
+    members = []
+    for caps in ([], [ZLIB], [BINARY, ZLIB]):
+        sock = socket.create_connection(("localhost", port))
+        CDProto.send_msg(sock, CDProto.register(f"member{len(members)}", caps))
+        stream = CDProtoStream(sock)
+        stream.binary = BINARY in caps
+        members.append((sock, stream))
+
+    sender = socket.create_connection(("localhost", port))
+    CDProto.send_msg(sender, CDProto.register("sender"))
+    time.sleep(0.2)
+    CDProto.send_msg(sender, CDProto.message(CODE))
+
+    sizes = []
+    for sock, stream in members:
+        sock.settimeout(1)
+        while not stream.has_frame():
+            stream.fill()
+        sizes.append(len(stream.buffer))
+        assert CDProto.recv_msg(stream).message == f"<<None>> [sender]: {CODE}"
+
+    assert sizes[1] < sizes[0] / 10 and sizes[2] < sizes[0] / 10
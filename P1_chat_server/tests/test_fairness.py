@@ -0,0 +1,109 @@
+"""Tests read budgets, rate limits and misbehaving clients of the selector server."""
+import socket
+import time
+
+from src.protocol import BINARY, CDProto
+
+from tests.helpers import closed, connect, recv_all, start
+
+
+def test_rate_limit():
+    server, port = start(rate=20, burst=5)
+    flood = connect(port, "flood")
+    quiet = connect(port, "quiet")
+    reader = connect(port, "reader")
+    time.sleep(0.2)
+
+    flood.sendall(b"".join(CDProto.encode_msg(CDProto.message(f"flood {i}")) for i in range(200)))
+    time.sleep(0.1)
+    CDProto.send_msg(quiet, CDProto.message("hello"))
+
+    msgs = [msg.message for msg in recv_all(reader, 1)]
+
+    assert "<<None>> [quiet]: hello" in msgs
+    flooded = [m for m in msgs if "[flood]" in m]
+    assert 5 <= len(flooded) <= 5 + 20 * 1.5       # burst + ~1s de tokens, o resto continua à espera
+    assert flooded == [f"<<None>> [flood]: flood {i}" for i in range(len(flooded))]   # nada se perde nem troca de ordem
+
+
+def test_read_budget():
+    server, port = start(read_budget=4)
+    flood = connect(port, "flood")
+    reader = connect(port, "reader")
+    time.sleep(0.2)
+
+    flood.sendall(b"".join(CDProto.encode_msg(CDProto.message(f"flood {i}")) for i in range(100)))
+
+    msgs = [msg.message for msg in recv_all(reader, 1)]
+    assert msgs == [f"<<None>> [flood]: flood {i}" for i in range(100)]
+
+
+def test_bad_frame_disconnects():
+    server, port = start()
+    bad = connect(port, "bad")
+    reader = connect(port, "reader")
+    time.sleep(0.2)
+
+    bad.sendall(b"\x00\x00")     # frame vazia
+    assert closed(bad)              # só esta ligação é fechada
+
+    CDProto.send_msg(connect(port, "other"), CDProto.message("still here"))
+    assert "<<None>> [other]: still here" in [msg.message for msg in recv_all(reader, 0.5)]
+
+
+def test_oversized_binary_message():
+    server, port = start()
+    reader = connect(port, "reader")
+    senders = []
+    for text in ("é" * 30000, "x" * 70000):     # cabe em binário mas não em JSON / nem em binário
+        sock = socket.create_connection(("localhost", port))
+        CDProto.send_msg(sock, CDProto.register("big", [BINARY]))
+        senders.append((sock, text))
+    time.sleep(0.2)
+
+    for sock, text in senders:
+        payload = CDProto.encode_msg(CDProto.message("x"), True)[4:]
+        payload = payload[:-1] + text.encode("UTF-8")       # encode_msg já recusa a mais longa
+        sock.sendall(len(payload).to_bytes(4, "big") + payload)
+        assert closed(sock)
+
+    huge = socket.create_connection(("localhost", port))
+    CDProto.send_msg(huge, CDProto.register("huge", [BINARY]))
+    huge.sendall((2 ** 31).to_bytes(4, "big") + b"\x03")      # o servidor não espera pelos 2 GiB
+    assert closed(huge)
+
+    CDProto.send_msg(connect(port, "other"), CDProto.message("still here"))
+    assert [msg.message for msg in recv_all(reader, 0.5)] == ["<<None>> [other]: still here"]
+
+
+def test_fast_readers_kept():
+    """A burst bigger than max_queued is fine as long as the reader keeps up with it."""
+
+    server, port = start(max_queued=16 * 1024, read_budget=1000)
+    readers = [connect(port, f"reader{i}") for i in range(3)]
+    senders = [connect(port, f"sender{i}") for i in range(10)]
+    time.sleep(0.2)
+
+    for i, sock in enumerate(senders):
+        sock.sendall(b"".join(CDProto.encode_msg(CDProto.message(f"{i} {j} " + "x" * 1000)) for j in range(20)))
+
+    for sock in readers:
+        assert len(recv_all(sock, 1)) == 200
+    assert len(server.streams) == 13
+
+
+def test_slow_reader_disconnected():
+    server, port = start(max_queued=64 * 1024)
+    slow = socket.socket()
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow.connect(("localhost", port))
+    CDProto.send_msg(slow, CDProto.register("slow"))        # nunca lê
+    sender = connect(port, "sender")
+    time.sleep(0.2)
+
+    text = "".join(map(str, range(3000)))       # ~10KB que o zlib não reduz a quase nada
+    for _ in range(500):
+        CDProto.send_msg(sender, CDProto.message(text))
+    time.sleep(0.5)
+
+    assert len(server.streams) == 1     # só resta o sender
@@ -0,0 +1,151 @@
+"""Tests three federated servers (in loop threads, and as separate server.py processes)."""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from src.federation import Federation
+from src.protocol import CDProto, CDProtoStream
+from src.server import Server
+
+from tests.helpers import free_ports
+
+SECRET = "s3cret"
+
+
+def wait(condition, seconds=5):
+    end = time.monotonic() + seconds
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+
+@pytest.fixture(scope="module")
+def servers():
+    servers = [Server(port=0, history=0) for _ in range(3)]     # portas livres escolhidas pelo sistema
+    nodes = [f"localhost:{server.sock_server.getsockname()[1]}" for server in servers]
+    for server, node in zip(servers, nodes):
+        server.federation = Federation(server, node, [n for n in nodes if n != node], SECRET)
+        threading.Thread(target=server.loop, daemon=True).start()
+
+    wait(lambda: all(len(server.federation.links) == 2 for server in servers))
+    return servers
+
+
+def port(server):
+    return server.sock_server.getsockname()[1]
+
+
+def connect(server, user, channel):
+    sock = socket.create_connection(("localhost", port(server)))
+    CDProto.send_msg(sock, CDProto.register(user))
+    CDProto.send_msg(sock, CDProto.join(channel))
+    sock.settimeout(1)
+    return sock, CDProtoStream(sock)
+
+
+def recv(stream):
+    msg = CDProto.recv_msg(stream)
+    while msg is None:
+        stream.fill()
+        msg = CDProto.recv_msg(stream)
+    return msg
+
+
+def interested(server, channel, count):
+    """Checks that server knows of count peers with members in channel."""
+
+    return sum(channel in channels for channels in server.federation.interest.values()) == count
+
+
+def test_federated_channel(servers):
+    foo = connect(servers[0], "Foo", "#fed")
+    bar = connect(servers[1], "Bar", "#fed")
+    baz = connect(servers[2], "Baz", "#other")
+    wait(lambda: interested(servers[0], "#fed", 1) and interested(servers[1], "#fed", 1))
+
+    CDProto.send_msg(foo[0], CDProto.message("Olá servidores", "#fed"))
+    assert recv(bar[1]).message == "<<#fed>> [Foo]: Olá servidores"
+
+    CDProto.send_msg(bar[0], CDProto.message("Olá Foo", "#fed"))
+    assert recv(foo[1]).message == "<<#fed>> [Bar]: Olá Foo"
+
+    with pytest.raises(socket.timeout):
+        recv(baz[1])
+
+    for sock, _ in (foo, bar, baz):
+        sock.close()
+
+
+def test_peer_rejected(servers):
+    nodes = list(servers[0].federation.addresses)
+    for peer in (CDProto.peer(nodes[0]), CDProto.peer(nodes[0], "wrong"), CDProto.peer("localhost:1", SECRET)):
+        sock = socket.create_connection(("localhost", port(servers[2])))
+        CDProto.send_msg(sock, peer)
+        # um cliente que se faz passar por servidor não podia injetar mensagens sem prefixo
+        CDProto.send_msg(sock, CDProto.message("<<#fed>> [admin]: forged", "#fed"))
+        sock.settimeout(1)
+        assert sock.recv(1) == b""
+        sock.close()
+
+    assert len(servers[2].federation.links) == 2
+
+
+def test_dial_does_not_block():
+    server = Server(port=0, history=0)
+    federation = Federation(server, "127.0.0.1:1", ["192.0.2.1:9"])     # endereço que nunca responde
+
+    start = time.monotonic()
+    federation.dial()
+    assert time.monotonic() - start < 0.1
+    assert len(federation.connecting) + len(federation.pending) == 1
+
+    federation.dial()       # antes de passar o intervalo entre tentativas não abre outra ligação
+    assert len(federation.connecting) + len(federation.pending) == 1
+
+
+def test_server_processes(tmp_path):
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py")
+    ports = free_ports(3)
+    nodes = [f"localhost:{p}" for p in ports]
+    procs = [subprocess.Popen([sys.executable, script, "--port", str(p), "--peer-secret", SECRET,
+                               "--peers", ",".join(n for n in nodes if n != node)],
+                              cwd=tmp_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)   # server.log fica em tmp_path
+             for p, node in zip(ports, nodes)]
+    try:
+        socks = []
+        for p, user in zip(ports, ("Foo", "Bar", "Baz")):
+            end = time.monotonic() + 5
+            while True:
+                try:
+                    sock = socket.create_connection(("localhost", p))
+                    break
+                except ConnectionRefusedError:
+                    assert time.monotonic() < end
+                    time.sleep(0.05)
+            CDProto.send_msg(sock, CDProto.register(user))
+            CDProto.send_msg(sock, CDProto.join("#fed"))
+            sock.settimeout(0.2)
+            socks.append((sock, CDProtoStream(sock)))
+
+        # até os servidores se ligarem e trocarem o interesse no canal, as mensagens não saem do servidor de origem
+        end = time.monotonic() + 10
+        while True:
+            CDProto.send_msg(socks[0][0], CDProto.message("ping", "#fed"))
+            try:
+                assert recv(socks[1][1]).message == "<<#fed>> [Foo]: ping"
+                assert recv(socks[2][1]).message == "<<#fed>> [Foo]: ping"
+                break
+            except socket.timeout:
+                assert time.monotonic() < end
+
+        for sock, _ in socks:
+            sock.close()
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
@@ -0,0 +1,67 @@
+"""Tests for the queued logging of the server."""
+import logging
+import queue
+
+from src.logs import EnqueueHandler, QueuedLogWriter, SamplingFilter
+
+
+class stream:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+
+    def flush(self):
+        pass
+
+
+def test_queued_writer():
+    out = stream()
+    handler = logging.StreamHandler(out)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    records = queue.SimpleQueue()
+    logger = logging.getLogger("test.queued")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(EnqueueHandler(records))
+
+    for i in range(100):
+        logger.debug("message %d", i)
+    assert out.writes == []     # quem faz log só coloca o registo na fila
+
+    writer = QueuedLogWriter(records, [handler])
+    writer.start()
+    writer.stop()
+
+    assert "".join(out.writes) == "".join(f"message {i}\n" for i in range(100))
+    assert len(out.writes) < 100    # escrito em lotes
+
+
+def test_args_snapshot():
+    out = stream()
+    handler = logging.StreamHandler(out)
+    handler.setFormatter(logging.Formatter("%(levelname)s:%(message)s"))
+
+    records = queue.SimpleQueue()
+    logger = logging.getLogger("test.snapshot")
+    logger.propagate = False
+    logger.addHandler(EnqueueHandler(records))
+
+    channels = [None]
+    logger.warning("channels: %s", channels)
+    channels.append("#cd")      # o loop continua a alterar a lista antes de o registo ser escrito
+
+    writer = QueuedLogWriter(records, [handler])
+    writer.start()
+    writer.stop()
+
+    assert "".join(out.writes) == "WARNING:channels: [None]\n"
+
+
+def test_sampling():
+    sample = SamplingFilter(10)
+    record = logging.makeLogRecord({})
+
+    assert sum(sample.filter(record) for _ in range(100)) == 10
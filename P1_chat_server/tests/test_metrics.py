@@ -0,0 +1,75 @@
+"""Tests the metrics of the selector server and its admin port."""
+import base64
+import json
+import os
+import socket
+import time
+
+from src.metrics import Histogram
+from src.protocol import CDProto
+
+from tests.helpers import free_ports, start
+
+
+def test_histogram():
+    hist = Histogram()
+    for us in [3] * 90 + [1000] * 9 + [50000]:
+        hist.observe(us / 1e6)
+
+    assert hist.percentile(0.5) == 4            # 3us cai no bucket até 4us
+    assert hist.percentile(0.99) == 1024
+    assert hist.snapshot()["max_us"] == 50000
+
+
+def read_admin(port):
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        return json.loads(sock.makefile().readline())
+
+
+def test_admin_port():
+    admin_port, = free_ports(1)
+    server, port = start(admin_port=admin_port)
+
+    socks = []
+    for i in range(3):
+        sock = socket.create_connection(("localhost", port))
+        CDProto.send_msg(sock, CDProto.register(f"user{i}"))
+        CDProto.send_msg(sock, CDProto.join("#cd"))
+        socks.append(sock)
+    time.sleep(0.1)
+    CDProto.send_msg(socks[0], CDProto.message("hello", "#cd"))
+    time.sleep(0.2)
+
+    stats = read_admin(admin_port)
+    assert stats["connections"] == 3
+    assert stats["members"] == {"None": 3, "#cd": 3}
+    assert stats["frames_in"] == 7
+    assert stats["frames_out"] == 2
+    assert stats["callback_time"]["count"] > 0 and stats["loop_time"]["count"] > 0
+
+
+def test_queued_per_connection():
+    admin_port, = free_ports(1)
+    server, port = start(admin_port=admin_port, max_queued=64 * 1024 * 1024)
+
+    readers = []
+    for _ in range(2):      # o mesmo username em duas ligações que não leem nada
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(("localhost", port))
+        CDProto.send_msg(sock, CDProto.register("bob"))
+        readers.append(sock)
+    sender = socket.create_connection(("localhost", port))
+    CDProto.send_msg(sender, CDProto.register("alice"))
+    time.sleep(0.1)
+    text = base64.b64encode(os.urandom(30000)).decode()    # sem compressão que valha a pena
+    for _ in range(100):
+        CDProto.send_msg(sender, CDProto.message(text))
+    time.sleep(0.5)
+
+    idle = socket.create_connection(("127.0.0.1", admin_port))     # nunca lê o snapshot: não pode parar o servidor
+    stats = read_admin(admin_port)
+    bobs = [entry for entry in stats["queued"].values() if entry["user"] == "bob"]
+    assert len(bobs) == 2 and all(entry["bytes"] > 0 for entry in bobs)
+    assert stats["queued_bytes"] == sum(entry["bytes"] for entry in stats["queued"].values())
+    idle.close()
@@ -1,11 +1,13 @@
 """Tests for the chat protocol."""
 import pytest
 from src.protocol import (
+    BINARY,
     CDProto,
     TextMessage,
     JoinMessage,
     RegisterMessage,
     CDProtoBadFormat,
+    CDProtoStream,
 )
 
 from freezegun import freeze_time
@@ -25,6 +27,16 @@ def test_protocol():
     )
 
 
+@freeze_time("Mar 16th, 2021")
+def test_encode():
+    frame = CDProto.encode_msg(CDProto.message("Hello World", "#cd"))
+    payload = b'{"command": "message", "message": "Hello World", "channel": "#cd", "ts": 1615852800}'
+
+    assert frame == len(payload).to_bytes(2, "big") + payload
+
+    assert CDProto.encode_msg(CDProto.join("#cd"))[2:] == b'{"command": "join", "channel": "#cd"}'
+
+
 class mock_socket:
     def __init__(self, content):
         self.g = self.gen_stream(content)
@@ -59,3 +71,141 @@ def test_recv():
 
     with pytest.raises(CDProtoBadFormat):
         CDProto.recv_msg(mock_socket(b"Hello World"))
+
+
+class chunked_socket:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+
+    def recv(self, n):
+        return next(self.chunks, b"")
+
+
+def test_stream():
+    register = CDProto.encode_msg(CDProto.register("student"))
+    join = CDProto.encode_msg(CDProto.join("#cd"))
+    text = CDProto.encode_msg(CDProto.message("Hello World", "#cd"))
+
+    # duas frames completas e metade da terceira no mesmo segmento
+    stream = CDProtoStream(chunked_socket([register + join + text[:5], text[5:]]))
+
+    stream.fill()
+    assert isinstance(CDProto.recv_msg(stream), RegisterMessage)
+    assert isinstance(CDProto.recv_msg(stream), JoinMessage)
+    assert CDProto.recv_msg(stream) is None
+
+    stream.fill()
+    msg = CDProto.recv_msg(stream)
+    assert isinstance(msg, TextMessage)
+    assert msg.message == "Hello World"
+    assert CDProto.recv_msg(stream) is None
+    assert not stream.closed
+
+    stream.fill()
+    assert stream.closed
+
+
+def test_stream_burst():
+    frames = [CDProto.encode_msg(CDProto.message(f"msg {i}", "#cd")) for i in range(1000)]
+    stream = CDProtoStream(chunked_socket([b"".join(frames[:600]), b"".join(frames[600:])]))
+
+    stream.fill()
+    received = []
+    msg = CDProto.recv_msg(stream)
+    while msg:
+        received.append(msg.message)
+        msg = CDProto.recv_msg(stream)
+
+    stream.fill()       # as frames já lidas só saem do buffer aqui
+    assert len(stream.buffer) == sum(map(len, frames[600:]))
+    msg = CDProto.recv_msg(stream)
+    while msg:
+        received.append(msg.message)
+        msg = CDProto.recv_msg(stream)
+
+    assert received == [f"msg {i}" for i in range(1000)]
+
+
+def test_stream_empty_frame():
+    join = CDProto.encode_msg(CDProto.join("#cd"))
+    stream = CDProtoStream(chunked_socket([join + b"\x00\x00" + join]))
+
+    stream.fill()
+    assert isinstance(CDProto.recv_msg(stream), JoinMessage)
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.recv_msg(stream)
+
+
+def test_frame_limits():
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.encode_msg(CDProto.message("é" * 20000))     # \u00e9 em JSON: 120000 bytes
+    assert len(CDProto.encode_msg(CDProto.message("é" * 20000), True)) < 65535
+
+    stream = CDProtoStream(chunked_socket([(70000).to_bytes(4, "big") + b"\x03"]))
+    stream.binary = True
+    stream.fill()
+    with pytest.raises(CDProtoBadFormat):       # recusada logo pelo header
+        CDProto.recv_msg(stream)
+
+
+def test_binary():
+    text = CDProto.message("Olá Mundo", "#cd")
+    frame = CDProto.encode_msg(text, binary=True)
+
+    assert int.from_bytes(frame[:4], "big") == len(frame) - 4
+    assert len(frame) < len(CDProto.encode_msg(text))
+
+    msg = CDProto.decode_msg(frame[4:], binary=True)
+    assert isinstance(msg, TextMessage)
+    assert (msg.message, msg.channel, msg.ts) == ("Olá Mundo", "#cd", text.ts)
+
+    msg = CDProto.decode_msg(CDProto.encode_msg(CDProto.message("Hi"), True)[4:], True)
+    assert msg.channel is None
+
+    assert CDProto.decode_msg(CDProto.encode_msg(CDProto.join("#cd"), True)[4:], True).channel == "#cd"
+
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.decode_msg(b"\x03\x00", binary=True)
+
+
+def test_register_caps():
+    register = CDProto.register("bot", [BINARY])
+    assert str(register) == '{"command": "register", "user": "bot", "caps": ["binary"]}'
+
+    msg = CDProto.decode_msg(CDProto.encode_msg(register)[2:])
+    assert msg.caps == [BINARY]
+
+    # o register inicial vai sempre em JSON, as frames seguintes no formato binário
+    stream = CDProtoStream(chunked_socket([CDProto.encode_msg(register) + CDProto.encode_msg(CDProto.join("#cd"), True)]))
+    stream.fill()
+    assert CDProto.recv_msg(stream).caps == [BINARY]
+    stream.binary = True
+    assert CDProto.recv_msg(stream).channel == "#cd"
+
+
+def test_ping():
+    assert str(CDProto.ping()) == '{"command": "ping"}'
+
+    for binary in (False, True):
+        size = 4 if binary else 2
+        assert CDProto.decode_msg(CDProto.encode_msg(CDProto.ping(), binary)[size:], binary).command == "ping"
+        assert CDProto.decode_msg(CDProto.encode_msg(CDProto.pong(), binary)[size:], binary).command == "pong"
+
+
+def test_resume():
+    assert str(CDProto.resume("#cd", 7)) == '{"command": "resume", "channel": "#cd", "offset": 7}'
+
+    text = CDProto.message("Hi", "#cd")
+    text.offset = 42
+    for binary in (False, True):
+        size = 4 if binary else 2
+        assert CDProto.decode_msg(CDProto.encode_msg(text, binary)[size:], binary).offset == 42
+
+        msg = CDProto.decode_msg(CDProto.encode_msg(CDProto.resume("#cd", ts=1615852800), binary)[size:], binary)
+        assert (msg.channel, msg.offset, msg.ts) == ("#cd", None, 1615852800)
+
+    for bad in ('"offset": "5"', '"offset": -1', '"ts": 1.5', '"offset": true', '"offset": null, "ts": [1]'):
+        with pytest.raises(CDProtoBadFormat):
+            CDProto.decode_msg(('{"command": "resume", "channel": "#cd", %s}' % bad).encode())
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.decode_msg(b'{"command": "resume", "channel": 5, "offset": 0}')
@@ -0,0 +1,43 @@
+"""Tests traffic recording and replay."""
+import socket
+import time
+
+from replay import Replayer
+from src.protocol import CDProto
+from src.recorder import CLOSE, CONNECT, DATA, read_events
+
+from tests.helpers import start
+
+
+def test_record_replay(tmp_path):
+    path = str(tmp_path / "traffic.rec")
+    server, port = start(record=path)
+
+    users = []
+    for i in range(3):
+        sock = socket.create_connection(("localhost", port))
+        CDProto.send_msg(sock, CDProto.register(f"user{i}"))
+        CDProto.send_msg(sock, CDProto.join("#cd"))
+        users.append(sock)
+    time.sleep(0.1)
+
+    for i in range(10):
+        CDProto.send_msg(users[i % 3], CDProto.message(f"hello {i}", "#cd"))
+        time.sleep(0.01)
+    time.sleep(0.1)
+    users[0].close()
+    time.sleep(0.1)
+    server.recorder.flush(force=True)
+
+    events = list(read_events(path))
+    assert [conn for _, conn, kind, _ in events if kind == CONNECT] == [0, 1, 2]
+    assert (events[-1][1], events[-1][2]) == (0, CLOSE)
+    assert b"hello 9" in b"".join(data for _, _, kind, data in events if kind == DATA)
+    assert [at for at, _, _, _ in events] == sorted(at for at, _, _, _ in events)
+
+    _, port = start()
+    summary = Replayer(path, port=port, speed=4).run()
+
+    assert summary["frames_sent"] == 3 * 2 + 10
+    assert summary["delivered"] == 10 * 2       # cada mensagem chega aos outros dois membros
+    assert summary["duration"] < 0.3            # 4x mais rápido do que a gravação
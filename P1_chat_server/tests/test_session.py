@@ -0,0 +1,59 @@
+"""Tests the headless multi-session client."""
+import time
+
+from src.session import SessionPool
+
+from tests.helpers import start
+
+
+def test_sessions():
+    server, port = start()
+
+    received = {}
+    pool = SessionPool(port=port,
+                       on_message=lambda session, msg: received.setdefault(session.name, []).append(msg.message))
+
+    bots = [pool.connect(f"bot{i}", binary=i % 2 == 1) for i in range(200)]
+    for i, bot in enumerate(bots):
+        bot.join(f"#room{i % 4}")
+    pool.run(0.3)
+
+    bots[0].send("hello room 0")
+    bots[1].send("hello room 1")
+    pool.run(2, until=lambda: sum(map(len, received.values())) == 2 * 49)
+
+    assert len(received) == 2 * 49      # cada mensagem chega aos outros 49 membros do canal
+    assert received["bot4"] == ["<<#room0>> [bot0]: hello room 0"]
+    assert received["bot5"] == ["<<#room1>> [bot1]: hello room 1"]
+
+    pool.close()
+    assert not pool.sessions
+
+
+def test_history():
+    server, port = start(history=3)
+
+    received = {}
+    pool = SessionPool(port=port,
+                       on_message=lambda session, msg: received.setdefault(session.name, []).append(msg.message))
+
+    member = pool.connect("member")
+    member.join("#cd")
+    pool.run(0.2)
+    for i in range(5):
+        member.send(f"msg {i}")
+        member.send(f"nobody here {i}", "#empty")     # canal sem membros: sem histórico
+    pool.run(0.3)
+    assert list(server.history) == ["#cd"]
+    assert server.history_size["#cd"] == sum(map(len, server.history["#cd"]))
+
+    for name, binary in (("json", False), ("binary", True)):
+        pool.connect(name, binary=binary).join("#cd")
+    pool.run(1, until=lambda: len(received) == 2)
+    assert received["json"] == received["binary"] == [f"<<#cd>> [member]: msg {i}" for i in range(2, 5)]
+
+    pool.close()
+    end = time.monotonic() + 1
+    while server.channels and time.monotonic() < end:
+        time.sleep(0.01)
+    assert not server.channels and not server.history       # o último membro saiu
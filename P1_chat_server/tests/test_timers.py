@@ -0,0 +1,49 @@
+"""Tests for the timer wheel."""
+from src.timers import TimerWheel
+
+
+class clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timer_wheel():
+    t = clock()
+    wheel = TimerWheel(tick=1, slots=4, clock=t)
+
+    assert wheel.timeout() is None
+
+    wheel.schedule("a", 2)
+    wheel.schedule("b", 6)      # mais de uma volta da roda
+    wheel.schedule("c", 3)
+    assert wheel.timeout() == 1
+
+    t.now = 1
+    assert wheel.advance() == []
+    t.now = 2
+    assert wheel.advance() == ["a"]
+
+    wheel.cancel("c")
+    wheel.schedule("b", 1)      # reagendar substitui o prazo anterior
+    assert len(wheel) == 1
+
+    t.now = 10
+    assert wheel.advance() == ["b"]
+    assert "b" not in wheel
+    assert wheel.timeout() is None
+
+
+def test_timer_wheel_rounds():
+    t = clock()
+    wheel = TimerWheel(tick=1, slots=4, clock=t)
+    wheel.schedule("x", 9)
+
+    expired = []
+    for second in range(1, 12):
+        t.now = second
+        expired += [(second, key) for key in wheel.advance()]
+
+    assert expired == [(9, "x")]
@@ -0,0 +1,66 @@
+"""Tests for the relay between server workers."""
+import time
+
+from src.protocol import CDProto
+from src.workers import WorkerRelay, run_workers
+
+from tests.helpers import connect, recv_all, start
+
+
+def test_relay(tmp_path):
+    relays = [WorkerRelay(str(tmp_path), i, 3) for i in range(3)]
+
+    frame = CDProto.encode_msg(CDProto.message("<<#cd>> [Foo]: Hello", "#cd"))
+    relays[0].publish(frame)
+
+    assert relays[0].recv() is None     # quem publica não recebe a sua própria frame
+    assert relays[1].recv() == frame
+    assert relays[2].recv() == frame
+    assert relays[1].recv() is None
+
+    for relay in relays:
+        relay.close()
+
+
+def test_relay_burst(tmp_path):
+    relays = [WorkerRelay(str(tmp_path), i, 3) for i in range(2)]     # o worker 2 não está a correr
+    frames = [CDProto.encode_msg(CDProto.message(f"msg {i}", "#cd")) for i in range(300)]
+    for frame in frames:
+        relays[0].publish(frame)
+
+    assert relays[0].dropped == 300         # só as do worker 2
+    assert relays[0].waiting()              # a fila do worker 1 encheu: o resto espera
+
+    received = []
+    while len(received) < len(frames):
+        for link in relays[0].waiting():
+            relays[0].flush(link)
+        frame = relays[1].recv()
+        while frame:
+            received.append(frame)
+            frame = relays[1].recv()
+    assert received == frames and not relays[0].waiting()
+
+    for relay in relays:
+        relay.close()
+
+
+def test_workers_burst(tmp_path):
+    """A burst on one worker reaches the channel members connected to another one."""
+
+    (first, port0), (_, port1) = [start(relay=WorkerRelay(str(tmp_path), i, 2)) for i in range(2)]
+    reader = connect(port1, "reader")
+    CDProto.send_msg(reader, CDProto.join("#cd"))
+    sender = connect(port0, "sender")
+    time.sleep(0.2)
+
+    sender.sendall(b"".join(CDProto.encode_msg(CDProto.message(f"msg {i}", "#cd")) for i in range(200)))
+
+    msgs = [msg.message for msg in recv_all(reader, 1)]
+    assert msgs == [f"<<#cd>> [sender]: msg {i}" for i in range(200)]
+    assert first.relay.dropped == 0
+
+
+def test_worker_failure(capfd):
+    assert run_workers(2, port=-1) == 1     # porta inválida: os dois workers falham logo no bind
+    assert "OverflowError" in capfd.readouterr().err
@@ -0,0 +1,129 @@
+import asyncio
+import itertools
+import logging
+import pickle
+import socket
+
+
+class AsyncDHTClient(asyncio.DatagramProtocol):
+    """ DHT client for asyncio.
+
+    Every request carries an id (rid) that the nodes echo in the reply, so
+    many requests can be in flight on the same socket and a late reply is
+    never taken as the answer to another request. Only PUT and GET carry a
+    rid (PUT_MANY and GET_MANY replies are matched by key, see DHTClient).
+    """
+
+    def __init__(self, address, timeout=1, retries=3, max_in_flight=64):
+        """ Initialize client.
+
+        Parameters:
+            address: address of a node in the DHT
+            timeout: seconds to wait for each attempt of a request
+            retries: attempts after the first one before giving up
+            max_in_flight: requests waiting for a reply at the same time (more wait their turn);
+                too many at once overflow the socket buffers of the nodes and end up resent
+        """
+        self.dht_addr = address
+        self.timeout = timeout
+        self.retries = retries
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.transport = None
+        self.rids = itertools.count()
+        self.pending = {}   # rid : future da resposta
+        self.logger = logging.getLogger("AsyncDHTClient")
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        # sem remote_addr: as respostas chegam do nó responsável pela chave, não do nó a quem enviámos
+        await loop.create_datagram_endpoint(lambda: self, local_addr=("0.0.0.0", 0), family=socket.AF_INET)
+        return self
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            out = pickle.loads(data)
+            future = self.pending.get(out.get("rid"))
+        except Exception:
+            self.logger.error("Invalid msg from %s", addr)
+            return
+
+        if future is None or future.done():     # resposta atrasada de um pedido que já terminou
+            self.logger.debug("Late reply: %s", out)
+            return
+        future.set_result(out)
+
+    async def request(self, method, args):
+        """ Send a request and wait for its reply, resending it after each timeout.
+
+        Raises TimeoutError when no reply arrives after all the retries.
+        """
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            rid = next(self.rids)
+            future = loop.create_future()
+            self.pending[rid] = future
+            payload = pickle.dumps({"method": method, "args": dict(args, rid=rid)})
+            timer = None
+
+            def attempt(left):
+                # um temporizador por pedido (sem wait_for, que cria uma task em cada tentativa)
+                nonlocal timer
+                if left == 0:
+                    future.set_exception(TimeoutError(f"{method} {args.get('key')!r}: no reply after {self.retries + 1} attempts"))
+                    return
+                if left <= self.retries:
+                    self.logger.debug("No reply to %s %d, resending", method, rid)
+                self.transport.sendto(payload, self.dht_addr)
+                timer = loop.call_later(self.timeout, attempt, left - 1)
+
+            attempt(self.retries + 1)
+            try:
+                return await future
+            finally:
+                timer.cancel()
+                del self.pending[rid]
+
+    async def put(self, key, value):
+        """ Store value to key in the DHT.
+
+        A put retried after its ACK was lost gets the ACK again: the node
+        remembers the rid of the puts it answered.
+        """
+        out = await self.request("PUT", {"key": key, "value": value})
+        if out["method"] != "ACK":
+            self.logger.error("Invalid msg: %s", out)
+            return False
+        return True
+
+    async def get(self, key):
+        """ Retrieve key from DHT."""
+        out = await self.request("GET", {"key": key})
+        if out["method"] != "ACK":
+            self.logger.error("Invalid msg: %s", out)
+            return None
+        return out["args"]
+
+
+async def main():
+    async with AsyncDHTClient(("localhost", 5000)) as client:
+        # todos os pedidos seguem de uma vez, as respostas chegam por qualquer ordem
+        print(await asyncio.gather(*(client.put(str(i), i * i) for i in range(100))))
+        print(await asyncio.gather(*(client.get(str(i)) for i in range(100))))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,12 +1,18 @@
 import socket
 import pickle
 import logging
+from bisect import bisect_left
+from collections import Counter, deque
+from hashing import hash_many
+from utils import MAX_DATAGRAM, ROUTE_OVERHEAD, split_batch
 
 
 class DHTClient:
-    def __init__(self, address):
-        """ Initialize client."""
+    def __init__(self, address, m_bits=10):
+        """ Initialize client (m_bits must be the same as the nodes')."""
         self.dht_addr = address
+        self.ring_size = pow(2, m_bits)
+        self.ring = None    # [(id, addr)] dos nós do anel, ordenados por id
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.logger = logging.getLogger("DHTClient")
 
@@ -34,6 +40,150 @@ class DHTClient:
             return None
         return out["args"]
 
+    def successor(self, id_num, retries):
+        """ Args of the SUCCESSOR_REP for id_num, asking again after each timeout (TimeoutError after the retries)."""
+        payload = pickle.dumps({"method": "SUCCESSOR", "args": {"id": id_num}})
+        for _ in range(retries + 1):
+            self.socket.sendto(payload, self.dht_addr)
+            try:
+                while True:
+                    out = pickle.loads(self.socket.recvfrom(MAX_DATAGRAM)[0])
+                    if out["method"] == "SUCCESSOR_REP" and out["args"]["req_id"] == id_num:
+                        return out["args"]
+                    self.logger.error("Invalid msg: %s", out)   # p.ex. resposta atrasada a outro id
+            except socket.timeout:
+                self.logger.debug("No reply to SUCCESSOR %d, resending", id_num)
+        raise TimeoutError(f"SUCCESSOR {id_num}: no reply after {retries + 1} attempts")
+
+    def nodes(self, refresh=False, timeout=1, retries=3):
+        """ Ids and addresses of the nodes in the DHT, found by following successors (kept for later calls).
+
+        Parameters:
+            timeout: seconds to wait for each reply
+            retries: attempts after the first one before raising TimeoutError
+        """
+        if self.ring is not None and not refresh:
+            return self.ring
+
+        ring = {}
+        id_num = 0
+        self.socket.settimeout(timeout)
+        try:
+            while True:
+                out = self.successor(id_num, retries)
+                succ_id = out["successor_id"]
+                if succ_id in ring:     # demos a volta ao anel
+                    break
+                ring[succ_id] = out["successor_addr"]
+                id_num = (succ_id + 1) % self.ring_size
+        finally:
+            self.socket.settimeout(None)
+
+        self.ring = sorted(ring.items())
+        return self.ring
+
+    def batches(self, method, items, keys, answer, timeout):
+        """ Send items grouped by the node responsible for each key, one batch in flight per node.
+
+        Parameters:
+            items: what goes in the messages, one item per key
+            answer: called with the args of each ACK, returns the keys it answers
+            timeout: seconds to wait for a reply before giving up on the keys still missing
+        Items too large for a datagram are not sent (and get no answer). The
+        messages carry no rid: replies are matched by key, and a late one only
+        answers keys still missing.
+        """
+        if not items:
+            return
+        ring = self.nodes()
+        ids = [node_id for node_id, _ in ring]
+        groups = {}
+        for item, key_hash in zip(items, hash_many(keys, maximum=self.ring_size)):
+            owner = ring[bisect_left(ids, key_hash) % len(ring)][1]
+            groups.setdefault(owner, []).append(item)
+
+        limit = MAX_DATAGRAM - ROUTE_OVERHEAD     # o lote ainda tem de caber quando um nó o reencaminha
+        queues = {}
+        for addr, group in groups.items():
+            queues[addr] = deque()
+            for msg in split_batch(method, group, limit=limit):
+                if len(msg["args"]["items"]) == 1 and len(pickle.dumps(msg)) > limit:
+                    self.logger.error("Item too large for a datagram: %.40r", msg["args"]["items"][0])
+                else:
+                    queues[addr].append(msg)
+        sent_to = {}                # chave sem resposta : nó a quem foi enviada
+        unanswered = Counter()      # nó : chaves do lote em curso ainda sem resposta
+        keys_of = (lambda items: [key for key, _ in items]) if method == "PUT_MANY" else list
+
+        def send_next(addr):
+            if queues[addr]:
+                msg = queues[addr].popleft()
+                for key in keys_of(msg["args"]["items"]):
+                    sent_to[key] = addr
+                unanswered[addr] = len(msg["args"]["items"])
+                self.socket.sendto(pickle.dumps(msg), addr)
+
+        for addr in queues:
+            send_next(addr)
+
+        self.socket.settimeout(timeout)
+        try:
+            while sent_to:
+                out = pickle.loads(self.socket.recvfrom(MAX_DATAGRAM)[0])
+                try:
+                    answered = answer(out["args"]) if out["method"] == "ACK" else []
+                except (KeyError, TypeError, ValueError):   # resposta atrasada de um put/get simples
+                    answered = []
+                if not answered:
+                    self.logger.error("Invalid msg: %s", out)
+
+                for key in answered:
+                    addr = sent_to.pop(key, None)
+                    if addr is not None:
+                        unanswered[addr] -= 1
+                        if not unanswered[addr]:
+                            send_next(addr)
+        except socket.timeout:
+            self.logger.error("No reply for %d keys", len(sent_to))
+        finally:
+            self.socket.settimeout(None)
+
+    def put_many(self, items, timeout=5):
+        """ Store many values in the DHT, with one batched message per responsible node.
+
+        Parameters:
+            items: dict (or iterable of (key, value) pairs)
+        Returns True if every key was stored.
+        """
+        items = dict(items)
+        stored = {}
+
+        def answer(args):
+            stored.update(dict.fromkeys(args["stored"], True))
+            stored.update(dict.fromkeys(args["exists"], False))
+            return args["stored"] + args["exists"]
+
+        self.batches("PUT_MANY", list(items.items()), list(items), answer, timeout)
+        failed = [key for key in items if not stored.get(key)]
+        if failed:
+            self.logger.error("%d keys not stored (first: %s)", len(failed), failed[0])
+        return not failed
+
+    def get_many(self, keys, timeout=5):
+        """ Retrieve many keys from the DHT, with one batched message per responsible node.
+
+        Returns a dict key : value (None when the key is not in the DHT or got no reply).
+        """
+        keys = list(dict.fromkeys(keys))
+        values = dict.fromkeys(keys)
+
+        def answer(args):
+            values.update(args["items"])
+            return [key for key, _ in args["items"]]
+
+        self.batches("GET_MANY", keys, keys, answer, timeout)
+        return values
+
 
 if __name__ == "__main__":
     client = DHTClient(("localhost", 5000))
@@ -4,7 +4,11 @@ import threading
 import logging
 import pickle
 import math
-from utils import dht_hash, contains
+from collections import Counter, OrderedDict
+from hashing import cached_hash, dht_hash, hash_many
+from utils import MAX_BITS, MAX_DATAGRAM, contains, split_batch
+
+RECENT_PUTS = 4096     # puts com rid lembrados para responder da mesma forma a uma repetição
 
 class FingerTable:
     """Finger Table."""
@@ -34,11 +38,12 @@ class FingerTable:
 
     def find(self, identification):
         """ Get node address of closest preceding node (in finger table) of identification. """
-        for i in range(len(self.finger)):
-            if contains(self.node_id, self.finger[i][0], identification): # caso contanha, retornar o endereço do nó anterior
-                return self.finger[i - 1][1]
+        for i in range(len(self.finger) - 1, -1, -1):      # do finger mais distante para o mais próximo
+            node_id = self.finger[i][0]
+            if node_id != identification and contains(self.node_id, identification, node_id): # finger entre nós e o id
+                return self.finger[i][1]
 
-        return self.finger[len(self.finger)-1][1] # retornar o último nó da finger table ==> caso nenhum nó esteja contido 
+        return self.finger[0][1]    # nenhum finger precede o id ==> o sucessor
         
 
     def refresh(self):
@@ -52,14 +57,9 @@ class FingerTable:
 
         
     def getIdxFromId(self, id):
-        for i in range(self.m_bits):
-            index = (self.node_id + pow(2, i))      # index = aos nós que são procurados
-            
-            if (index > pow(2,self.m_bits) - 1):    # caso o node a procurar seja maior do que 1023, calculamo-lo de maneira circular
-                index =  index - pow(2,self.m_bits)
-               
-            if index == id:
-                return i + 1
+        distance = (id - self.node_id) % pow(2, self.m_bits)     # distância (circular) a que o id está de nós
+        if distance and distance & (distance - 1) == 0:         # os fingers estão a distâncias 2^(k-1)
+            return distance.bit_length()
 
         return None
 
@@ -80,17 +80,23 @@ class FingerTable:
 class DHTNode(threading.Thread):
     """ DHT Node Agent. """
 
-    def __init__(self, address, dht_address=None, timeout=3):
+    def __init__(self, address, dht_address=None, timeout=3, m_bits=10):
         """Constructor
 
         Parameters:
             address: self's address
             dht_address: address of a node in the DHT
             timeout: impacts how often stabilize algorithm is carried out
+            m_bits: size of the identifier space (2^m_bits ids, up to 160 bits), the same in every node
         """
         threading.Thread.__init__(self)
+        if not 1 <= m_bits <= MAX_BITS:
+            raise ValueError(f"m_bits must be between 1 and {MAX_BITS}")
+
         self.done = False
-        self.identification = dht_hash(address.__str__())
+        self.m_bits = m_bits
+        self.ring_size = pow(2, m_bits)
+        self.identification = dht_hash(address.__str__(), maximum=self.ring_size)
         self.addr = address  # My address
         self.dht_address = dht_address  # Address of the initial Node
         if dht_address is None:
@@ -108,9 +114,11 @@ class DHTNode(threading.Thread):
             self.predecessor_addr = None
 
         #TODO create finger_table
-        self.finger_table = FingerTable(self.identification, self.addr)
+        self.finger_table = FingerTable(self.identification, self.addr, m_bits)
 
         self.keystore = {}  # Where all data is stored
+        self.recent_puts = OrderedDict()    # (endereço do cliente, rid, key) : resposta enviada
+        self.hops = {"PUT": Counter(), "GET": Counter(), "SUCCESSOR": Counter()}   # nº de saltos : lookups resolvidos aqui
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.settimeout(timeout)
         self.logger = logging.getLogger("Node {}".format(self.identification))
@@ -118,12 +126,21 @@ class DHTNode(threading.Thread):
     def send(self, address, msg):
         """ Send msg to address. """
         payload = pickle.dumps(msg)
-        self.socket.sendto(payload, address)
+        try:
+            self.socket.sendto(payload, address)
+        except OSError as err:      # p.ex. maior que um datagrama: perde-se esta mensagem, não o nó
+            self.logger.error("Could not send %s to %s: %s", msg.get("method"), address, err)
+
+    def reply(self, address, msg, rid=None):
+        """ Send the reply msg to a client request (with its id, when the client sent one). """
+        if rid is not None:
+            msg["rid"] = rid
+        self.send(address, msg)
 
     def recv(self):
         """ Retrieve msg payload and from address."""
         try:
-            payload, addr = self.socket.recvfrom(1024)
+            payload, addr = self.socket.recvfrom(MAX_DATAGRAM)
         except socket.timeout:
             return None, None
 
@@ -183,6 +200,14 @@ class DHTNode(threading.Thread):
         self.logger.info(self)
 
 
+    def closest_preceding(self, id_num):
+        """Address of the closest node (known to us) preceding id_num, where a lookup goes next."""
+
+        addr = self.finger_table.find(id_num)
+        if addr == self.addr:       # finger ainda por preencher
+            return self.successor_addr
+        return addr
+
     def get_successor(self, args):
         """Process SUCCESSOR message.
 
@@ -191,22 +216,24 @@ class DHTNode(threading.Thread):
         """
 
         self.logger.debug("Get successor: %s", args)
-        #TODO Implement processing of SUCCESSOR message
         id_num = args["id"]
         addr = args["from"]
+        hops = args.get("hops", 0)
 
         # ask node n to find the successor of id
         if self.predecessor_id is None or contains( self.predecessor_id, self.identification, id_num): # se o predecessor for nulo ou o id estiver entre o predecessor e o identification, então enviamos para o identification
+            self.hops["SUCCESSOR"][hops] += 1
             dic = {"method": "SUCCESSOR_REP", "args": {"req_id": id_num, "successor_id": self.identification, "successor_addr": self.addr}}
             self.send(addr, dic)
 
         elif contains(self.identification, self.successor_id, id_num): # se o id estiver entre o identification e o sucessor, então enviamos para o identification
+            self.hops["SUCCESSOR"][hops] += 1
             dic = {"method": "SUCCESSOR_REP", "args": {"req_id": id_num, "successor_id": self.successor_id, "successor_addr": self.successor_addr}}
             self.send(addr, dic)
 
-        else:
-            dic = {"method": "SUCCESSOR", 'args': {"id": id_num, "from": addr}}
-            self.send(self.successor_addr, dic)
+        else: # enviar para o finger que mais se aproxima do id, sem o ultrapassar
+            dic = {"method": "SUCCESSOR", 'args': {"id": id_num, "from": addr, "hops": hops + 1}}
+            self.send(self.closest_preceding(id_num), dic)
             
                 
     def notify(self, args):
@@ -263,64 +290,139 @@ class DHTNode(threading.Thread):
             self.get_successor(args)
         
 
-    def put(self, key, value, address):
+    def put(self, key, value, address, hops=0, rid=None):
         """Store value in DHT.
 
         Parameters:
         key: key of the data
         value: data to be stored
         address: address where to send ack/nack
+        hops: number of nodes the request went through until here
+        rid: id of the client request, echoed in the forwarded request and in the reply
+            (a repeated request gets the same reply as the first one, ACK included)
         """
-        key_hash = dht_hash(key) 
+        key_hash = cached_hash(key, self.ring_size)
         self.logger.debug("Put: %s %s", key, key_hash)
 
-        #TODO Replace next code:
         # key_hash = nó atual
         if contains(self.identification, self.successor_id, key_hash):      # se o nó atual estiver entre o id e o sucessor
-            dic = {"method": "PUT", "args": {"key": key, "value": value, "from": address}}
+            dic = {"method": "PUT", "args": {"key": key, "value": value, "from": address, "hops": hops + 1, "rid": rid}}
             self.send(self.successor_addr, dic)
 
         elif contains(self.predecessor_id, self.identification, key_hash): # se estiver dentro, então adicionamos ao dicionário keystore
-            if key in self.keystore:
+            self.hops["PUT"][hops] += 1
+            request = (address, rid, key)
+            if rid is not None and request in self.recent_puts:    # repetição de um put cuja resposta se perdeu
+                dic = {'method': self.recent_puts[request]}
+            elif key in self.keystore:
                 dic = {'method': 'NACK'}
-                self.send(address, dic)
             else:
                 self.keystore[key] = value
                 dic = {'method': 'ACK'}
-                self.send(address, dic)
 
-        else: # se não estiver, enviar mensagem para o nó sucessor
-            addr = self.finger_table.find(key_hash) # buscar o endereço do nó que corresponde a esta key
-            dic = {"method": "PUT", "args": {"key": key, "value": value, "from": address}}
+            if rid is not None:
+                self.recent_puts[request] = dic['method']
+                if len(self.recent_puts) > RECENT_PUTS:
+                    self.recent_puts.popitem(last=False)
+            self.reply(address, dic, rid)
+
+        else: # se não estiver, enviar para o finger que mais se aproxima da key
+            addr = self.closest_preceding(key_hash)
+            dic = {"method": "PUT", "args": {"key": key, "value": value, "from": address, "hops": hops + 1, "rid": rid}}
             self.send(addr, dic) 
         
 
 
-    def get(self, key, address):
+    def get(self, key, address, hops=0, rid=None):
         """Retrieve value from DHT.
 
         Parameters:
         key: key of the data
         address: address where to send ack/nack
+        hops: number of nodes the request went through until here
+        rid: id of the client request, echoed in the forwarded request and in the reply
         """
-        key_hash = dht_hash(key)
+        key_hash = cached_hash(key, self.ring_size)
         self.logger.debug("Get: %s %s", key, key_hash)
 
-        #TODO Replace next code:
         if contains(self.identification, self.successor_id, key_hash):  # se o nó atual estiver entre o id e o sucessor
-            dic = {"method": "GET", "args": {"key": key, "from": address}}
+            dic = {"method": "GET", "args": {"key": key, "from": address, "hops": hops + 1, "rid": rid}}
             self.send(self.successor_addr, dic)
 
         elif contains(self.predecessor_id, self.identification, key_hash): # se estiver entre o predecessor e o id, então adicionamos ao dicionário keystore
+            self.hops["GET"][hops] += 1
             value = self.keystore[key]
             dic = {'method': 'ACK', "args": value}
-            self.send(address, dic)
+            self.reply(address, dic, rid)
             
-        else: # se não estiver, enviar mensagem para o nó sucessor
-            addr = self.finger_table.find(key_hash) # buscar o endereço do nó que corresponde a esta key
-            dic = {"method": "GET", "args": {"key": key, "from": address}}
+        else: # se não estiver, enviar para o finger que mais se aproxima da key
+            addr = self.closest_preceding(key_hash)
+            dic = {"method": "GET", "args": {"key": key, "from": address, "hops": hops + 1, "rid": rid}}
             self.send(addr, dic)
 
+    def next_hop(self, key_hash):
+        """Address where a request for key_hash goes next (None when the key is ours)."""
+
+        if contains(self.identification, self.successor_id, key_hash):
+            return self.successor_addr
+        if self.predecessor_id is None or contains(self.predecessor_id, self.identification, key_hash):
+            return None
+        return self.closest_preceding(key_hash)
+
+    def forward_many(self, method, batches, address, hops):
+        """Sends each batch of keys (next hop : items) on its way."""
+
+        for addr, items in batches.items():
+            for msg in split_batch(method, items, {"from": address, "hops": hops + 1}):
+                self.send(addr, msg)
+
+    def put_many(self, items, address, hops=0):
+        """Store a batch of values in DHT (the ones owned by other nodes are forwarded, one batch per next hop).
+
+        Parameters:
+        items: list of (key, value) pairs
+        address: address where to send the ack, listing the stored keys and the ones that already existed
+        hops: number of nodes the batch went through until here
+        """
+        stored, exists, forward = [], [], {}
+        for (key, value), key_hash in zip(items, hash_many([key for key, _ in items], maximum=self.ring_size)):
+            addr = self.next_hop(key_hash)
+            if addr is not None:
+                forward.setdefault(addr, []).append((key, value))
+            elif key in self.keystore:
+                exists.append(key)
+            else:
+                self.keystore[key] = value
+                stored.append(key)
+
+        self.logger.debug("Put many: %d stored, %d exist, %d forwarded", len(stored), len(exists), len(items) - len(stored) - len(exists))
+        if stored or exists:
+            self.hops["PUT"][hops] += len(stored) + len(exists)
+            self.send(address, {"method": "ACK", "args": {"stored": stored, "exists": exists}})
+        self.forward_many("PUT_MANY", forward, address, hops)
+
+    def get_many(self, keys, address, hops=0):
+        """Retrieve a batch of values from DHT (the keys owned by other nodes are forwarded, one batch per next hop).
+
+        Parameters:
+        keys: list of keys
+        address: address where to send the (key, value) pairs found here (value None when the key does not exist)
+        hops: number of nodes the batch went through until here
+        """
+        found, forward = [], {}
+        for key, key_hash in zip(keys, hash_many(keys, maximum=self.ring_size)):
+            addr = self.next_hop(key_hash)
+            if addr is None:
+                found.append((key, self.keystore.get(key)))
+            else:
+                forward.setdefault(addr, []).append(key)
+
+        self.logger.debug("Get many: %d found, %d forwarded", len(found), len(keys) - len(found))
+        if found:
+            self.hops["GET"][hops] += len(found)
+            for msg in split_batch("ACK", found):       # os valores podem não caber num só datagrama
+                self.send(address, msg)
+        self.forward_many("GET_MANY", forward, address, hops)
 
     def run(self):
         self.socket.bind(self.addr)
@@ -353,42 +455,58 @@ class DHTNode(threading.Thread):
             if payload is not None:
                 output = pickle.loads(payload)
                 self.logger.info("O: %s", output)
-                if output["method"] == "JOIN_REQ":
-                    self.node_join(output["args"])
-                elif output["method"] == "NOTIFY":
-                    self.notify(output["args"])
-                elif output["method"] == "PUT":
-                    self.put(
-                        output["args"]["key"],
-                        output["args"]["value"],
-                        output["args"].get("from", addr),
-                    )
-                elif output["method"] == "GET":
-                    self.get(output["args"]["key"], output["args"].get("from", addr))
-                elif output["method"] == "PREDECESSOR":
-                    # Reply with predecessor id
-                    self.send(
-                        addr, {"method": "STABILIZE", "args": self.predecessor_id}
-                    )
-                elif output["method"] == "SUCCESSOR":
-                    self.get_successor(output["args"])
-                elif output["method"] == "STABILIZE":
-                    # Initiate stabilize protocol
-                    self.stabilize(output["args"], addr)
-                elif output["method"] == "SUCCESSOR_REP":
-                    #TODO Implement processing of SUCCESSOR_REP
-                    index = output["args"]["req_id"]
-                    succ_id = output["args"]["successor_id"]
-                    succ_addr = output["args"]["successor_addr"]
-
-                    index = self.finger_table.getIdxFromId(index)
-                    if (index != None):
-                        self.finger_table.update(index, succ_id, succ_addr)
+                self.handle(output, addr)
 
             else:  # timeout occurred, lets run the stabilize algorithm
                 # Ask successor for predecessor, to start the stabilize process
                 self.send(self.successor_addr, {"method": "PREDECESSOR"})
 
+    def handle(self, output, addr):
+        """Process a message received from addr."""
+
+        if output["method"] == "JOIN_REQ":
+            self.node_join(output["args"])
+        elif output["method"] == "NOTIFY":
+            self.notify(output["args"])
+        elif output["method"] == "PUT":
+            self.put(
+                output["args"]["key"],
+                output["args"]["value"],
+                output["args"].get("from", addr),
+                output["args"].get("hops", 0),
+                output["args"].get("rid"),
+            )
+        elif output["method"] == "GET":
+            self.get(
+                output["args"]["key"],
+                output["args"].get("from", addr),
+                output["args"].get("hops", 0),
+                output["args"].get("rid"),
+            )
+        elif output["method"] == "PUT_MANY":
+            self.put_many(output["args"]["items"], output["args"].get("from", addr), output["args"].get("hops", 0))
+        elif output["method"] == "GET_MANY":
+            self.get_many(output["args"]["items"], output["args"].get("from", addr), output["args"].get("hops", 0))
+        elif output["method"] == "PREDECESSOR":
+            # Reply with predecessor id
+            self.send(
+                addr, {"method": "STABILIZE", "args": self.predecessor_id}
+            )
+        elif output["method"] == "SUCCESSOR":
+            output["args"].setdefault("from", addr)     # clientes perguntam sem indicar o endereço
+            self.get_successor(output["args"])
+        elif output["method"] == "STABILIZE":
+            # Initiate stabilize protocol
+            self.stabilize(output["args"], addr)
+        elif output["method"] == "SUCCESSOR_REP":
+            index = output["args"]["req_id"]
+            succ_id = output["args"]["successor_id"]
+            succ_addr = output["args"]["successor_addr"]
+
+            index = self.finger_table.getIdxFromId(index)
+            if (index != None):
+                self.finger_table.update(index, succ_id, succ_addr)
+
     def __str__(self):
         return "Node ID: {}; DHT: {}; Successor: {}; Predecessor: {}; FingerTable: {}".format(
             self.identification,
@@ -0,0 +1,50 @@
+"""Compares the speed of dht_hash and hash_many with the original dht_hash."""
+import argparse
+import random
+import string
+import time
+
+from hashing import dht_hash, hash_many
+
+
+def original_hash(text, seed=0, maximum=2**10):
+    """dht_hash as it was written at first (one character at a time, unbounded integer)."""
+    # multiplica inteiros cada vez maiores: quadrático no tamanho da chave
+    fnv_prime = 16777619
+    offset_basis = 2166136261
+    h = offset_basis + seed
+    for char in text:
+        h = h ^ ord(char)
+        h = h * fnv_prime
+    return h % maximum
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    samples = ["".join(rng.choices(string.printable, k=rng.randrange(args.length + 1))) for _ in range(args.keys)]
+
+    # o melhor de várias repetições, para o ruído de outros processos pesar pouco
+    original = min(timed(lambda: [original_hash(key, 0, args.maximum) for key in samples]) for _ in range(args.repeat))
+    single = min(timed(lambda: [dht_hash(key, 0, args.maximum) for key in samples]) for _ in range(args.repeat))
+    batch = min(timed(hash_many, samples, 0, args.maximum) for _ in range(args.repeat))
+
+    print(f"{args.keys} keys of up to {args.length} characters, ring of {args.maximum} ids")
+    print(f"original  {original * 1e3:9.2f} ms")
+    print(f"dht_hash  {single * 1e3:9.2f} ms  ({original / single:.1f}x)")
+    print(f"hash_many {batch * 1e3:9.2f} ms  ({original / batch:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", help="number of keys", type=int, default=20)
+    parser.add_argument("--length", help="maximum length of a key", type=int, default=4000)
+    parser.add_argument("--maximum", help="number of ids of the ring", type=int, default=2**10)
+    parser.add_argument("--repeat", help="runs of each function (the fastest counts)", type=int, default=5)
+    parser.add_argument("--seed", help="seed of the random keys", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,66 @@
+"""Key hashing of the DHT: FNV-1a (SHA-1 on rings larger than 2^32 ids)."""
+import hashlib
+from functools import lru_cache
+
+FNV_PRIME = 16777619
+OFFSET_BASIS = 2166136261
+MASK = 2**32 - 1
+LONG_KEY = 48        # a partir daqui compensa truncar o hash a 32 bits em cada carácter
+CACHE_SIZE = 4096
+
+
+def _values(text):
+    """Iterable with the value hashed for each character of text (a str or bytes)."""
+
+    if isinstance(text, str):
+        return text.encode("ascii") if text.isascii() else map(ord, text)
+    return text
+
+
+def dht_hash(text, seed=0, maximum=2**10):
+    """ FNV-1a Hash Function (SHA-1 for rings larger than 2**32). """
+    if maximum > 2**32:     # o FNV-1a de 32 bits deixaria as chaves curtas todas no início de um anel tão grande
+        data = text.encode("UTF-8") if isinstance(text, str) else bytes(text)
+        digest = hashlib.sha1(seed.to_bytes(8, "big") + data).digest()
+        return int.from_bytes(digest, "big") % maximum
+
+    h = OFFSET_BASIS + seed
+    if len(text) > LONG_KEY and maximum & (maximum - 1) == 0:
+        # os bits baixos não dependem dos altos: cortar a 32 bits em cada passo para o inteiro não crescer
+        h &= MASK
+        for value in _values(text):
+            h = ((h ^ value) * FNV_PRIME) & MASK
+    else:
+        for value in _values(text):
+            h = (h ^ value) * FNV_PRIME
+    return h % maximum
+
+
+def hash_many(keys, seed=0, maximum=2**10):
+    """dht_hash of every key, in order (for bulk operations)."""
+
+    if maximum > 2**32:
+        return [dht_hash(key, seed, maximum) for key in keys]
+
+    truncate = maximum & (maximum - 1) == 0
+    start = OFFSET_BASIS + seed
+    hashes = []
+    for key in keys:
+        h = start
+        values = key.encode("ascii") if isinstance(key, str) and key.isascii() else _values(key)
+        if truncate and len(key) > LONG_KEY:
+            h &= MASK
+            for value in values:
+                h = ((h ^ value) * FNV_PRIME) & MASK
+        else:
+            for value in values:
+                h = (h ^ value) * FNV_PRIME
+        hashes.append(h % maximum)
+    return hashes
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def cached_hash(key, maximum=2**10):
+    """dht_hash(key, 0, maximum), memoized for the most recently used keys."""
+
+    return dht_hash(key, 0, maximum)
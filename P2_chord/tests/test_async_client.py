@@ -0,0 +1,77 @@
+"""Tests the asyncio client on a running DHT."""
+import asyncio
+import pickle
+import time
+
+import pytest
+from AsyncDHTClient import AsyncDHTClient
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_many_in_flight():
+    async def go():
+        async with AsyncDHTClient(("localhost", 5000)) as client:
+            puts = await asyncio.gather(*(client.put(f"async{i}", i) for i in range(1000)))
+            gets = await asyncio.gather(*(client.get(f"async{i}") for i in reversed(range(1000))))
+            return puts, gets
+
+    puts, gets = run(go())
+    assert all(puts)
+    assert gets == list(reversed(range(1000)))
+
+
+def test_timeout_and_retries():
+    async def go():
+        async with AsyncDHTClient(("localhost", 5999), timeout=0.1, retries=2) as client:
+            await client.get("nobody")
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        run(go())
+    assert time.monotonic() - start >= 0.3
+
+
+def test_late_reply_ignored():
+    async def go():
+        async with AsyncDHTClient(("localhost", 5000)) as client:
+            assert await client.put("late", "on time")
+            # resposta de um pedido que já terminou: não pode ser dada ao próximo
+            client.datagram_received(pickle.dumps({"method": "ACK", "args": "stale", "rid": 0}), None)
+            return await client.get("late")
+
+    assert run(go()) == "on time"
+
+
+class SlowNode(asyncio.DatagramProtocol):
+    """Answers every request with an ACK (echoing its rid) after delay seconds, like a distant node."""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        rid = pickle.loads(data)["args"]["rid"]
+        reply = pickle.dumps({"method": "ACK", "rid": rid})
+        asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, reply, addr)
+
+
+def test_pipelining_hides_latency():
+    async def go():
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(lambda: SlowNode(0.02), local_addr=("127.0.0.1", 0))
+        try:
+            async with AsyncDHTClient(transport.get_extra_info("sockname")) as client:
+                start = time.monotonic()
+                results = await asyncio.gather(*(client.put(f"slow{i}", i) for i in range(200)))
+                return results, time.monotonic() - start
+        finally:
+            transport.close()
+
+    results, elapsed = run(go())
+    assert all(results)
+    assert elapsed < 200 * 0.02 / 4     # um pedido de cada vez seriam 4 s
@@ -26,3 +26,16 @@ def test_put_remote(client):
 def test_get_remote(client):
     """ retrieve from DHT (this key is not on the first node -> remote search) """
     assert client.get("2") == "xpto"
+
+
+def test_put_many(client):
+    """ add many objects at once (one batch per node) """
+    assert client.put_many({f"bulk{i}": i for i in range(5000)})
+    assert len(client.nodes()) == 5
+
+
+def test_get_many(client):
+    """ retrieve many objects at once """
+    values = client.get_many([f"bulk{i}" for i in range(5000)] + ["missing"])
+    assert values == dict({f"bulk{i}": i for i in range(5000)}, missing=None)
+    assert client.get("bulk42") == 42
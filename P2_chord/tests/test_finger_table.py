@@ -35,3 +35,18 @@ def test_finger_table():
         (3, 14, ("localhost", 5003)),
         (4, 2, ("localhost", 5004)),
     ]
+
+
+def test_large_finger_table():
+    node_id = 2 ** 159 + 5
+    f = FingerTable(node_id, ("localhost", 5000), 160)
+
+    assert f.getIdxFromId(node_id + 1) == 1
+    assert f.getIdxFromId(node_id + 2 ** 100) == 101
+    assert f.getIdxFromId((node_id + 2 ** 159) % 2 ** 160) == 160
+    assert f.getIdxFromId(node_id + 3) is None
+    assert f.getIdxFromId(node_id) is None
+
+    refresh = f.refresh()
+    assert len(refresh) == 160
+    assert refresh[-1] == (160, 5, ("localhost", 5000))
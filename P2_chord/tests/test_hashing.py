@@ -0,0 +1,57 @@
+"""Tests the key hashing functions against the original dht_hash."""
+import random
+import string
+
+import pytest
+from hashing import cached_hash, dht_hash, hash_many
+
+
+def original_hash(text, seed=0, maximum=2**10):
+    """dht_hash as it was written at first (one character at a time, unbounded integer)."""
+    fnv_prime = 16777619
+    offset_basis = 2166136261
+    h = offset_basis + seed
+    for char in text:
+        h = h ^ ord(char)
+        h = h * fnv_prime
+    return h % maximum
+
+
+def keys(count, length, seed=0):
+    rng = random.Random(seed)
+    return ["".join(rng.choices(string.printable, k=rng.randrange(length + 1))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("maximum", [2**10, 2**16, 2**32, 1000])
+def test_same_as_original(maximum):
+    samples = keys(300, 40) + keys(30, 300) + ["ç" * 60, "", "d", "f", "ação", "日本語", "😀" * 3, "('localhost', 5000)"]
+    for seed in (0, 7):
+        expected = [original_hash(key, seed, maximum) for key in samples]
+
+        assert [dht_hash(key, seed, maximum) for key in samples] == expected
+        assert hash_many(samples, seed, maximum) == expected
+
+    assert [cached_hash(key, maximum) for key in samples] == [original_hash(key, 0, maximum) for key in samples]
+    assert dht_hash(b"abc") == original_hash("abc")
+
+
+def test_large_ring():
+    assert dht_hash("key", maximum=2**160) == dht_hash("key", maximum=2**160)
+    assert dht_hash("key", maximum=2**160) != dht_hash("key", 1, maximum=2**160)
+    assert max(hash_many(keys(50, 5), maximum=2**64)) > 2**32
+
+
+def test_cache():
+    cached_hash.cache_clear()
+    for _ in range(3):
+        cached_hash("hot key")
+    assert cached_hash.cache_info().hits == 2
+
+
+def test_long_keys():
+    # a velocidade face ao original é medida em bench_hashing.py, aqui só o resultado
+    samples = keys(20, 4000)
+    expected = [original_hash(key) for key in samples]
+
+    assert [dht_hash(key) for key in samples] == expected
+    assert hash_many(samples) == expected
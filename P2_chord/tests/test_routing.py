@@ -0,0 +1,215 @@
+"""Tests finger routing on stable rings (messages delivered in memory) and the size of the batches."""
+import math
+import pickle
+import random
+import socket
+import time
+from bisect import bisect_left
+
+import pytest
+from DHTClient import DHTClient
+from DHTNode import DHTNode
+from utils import MAX_DATAGRAM, dht_hash
+
+CLIENT = ("client", 0)
+
+
+def build_ring(size, m_bits=10):
+    """Nodes of a stable ring of size nodes (2^m_bits ids), with correct successors, predecessors and fingers."""
+
+    nodes = {}
+    port = 7000
+    while len(nodes) < size:
+        node = DHTNode(("localhost", port), m_bits=m_bits)
+        node.socket.close()
+        nodes.setdefault(node.identification, node)     # ids repetidos ficam de fora
+        port += 1
+
+    ids = sorted(nodes)
+    for i, node_id in enumerate(ids):
+        node = nodes[node_id]
+        succ, pred = nodes[ids[(i + 1) % size]], nodes[ids[i - 1]]
+        node.successor_id, node.successor_addr = succ.identification, succ.addr
+        node.predecessor_id, node.predecessor_addr = pred.identification, pred.addr
+
+        for k in range(node.finger_table.m_bits):
+            start = (node_id + 2 ** k) % 2 ** node.finger_table.m_bits
+            owner = nodes[ids[bisect_left(ids, start) % size]]
+            node.finger_table.update(k + 1, owner.identification, owner.addr)
+
+    return nodes
+
+
+def deliver(nodes, first):
+    """Runs first() and delivers every message sent until the network is quiet; returns the client replies."""
+
+    by_addr = {node.addr: node for node in nodes.values()}
+    queue, replies = [], []
+    for node in nodes.values():
+        node.send = lambda address, msg: queue.append((address, msg))
+
+    first()
+    while queue:
+        address, msg = queue.pop(0)
+        if address == CLIENT:
+            replies.append(msg)
+        else:
+            by_addr[address].handle(msg, CLIENT)
+    return replies
+
+
+def hop_counts(nodes, method):
+    hops = []
+    for node in nodes.values():
+        for count, times in node.hops[method].items():
+            hops += [count] * times
+    return hops
+
+
+@pytest.mark.parametrize("size, m_bits", [(5, 10), (50, 10), (200, 10), (200, 64), (50, 160)])
+def test_successor_hops(size, m_bits):
+    random.seed(size)
+    nodes = build_ring(size, m_bits)
+    ids = sorted(nodes)
+    starts = list(nodes.values())
+
+    for _ in range(300):
+        id_num = random.randrange(2 ** m_bits)
+        start = random.choice(starts)
+        replies = deliver(nodes, lambda: start.get_successor({"id": id_num, "from": CLIENT}))
+
+        assert replies[0]["args"]["successor_id"] == ids[bisect_left(ids, id_num) % size]
+
+    hops = hop_counts(nodes, "SUCCESSOR")
+    assert len(hops) == 300
+    assert sum(hops) / len(hops) <= max(1, math.log2(size))     # lookups logarítmicos
+    assert max(hops) <= 2 * math.log2(size) + 1
+
+
+def test_put_get_hops():
+    nodes = build_ring(100)
+    starts = list(nodes.values())
+
+    for i in range(200):
+        replies = deliver(nodes, lambda: random.choice(starts).put(f"key{i}", i, CLIENT))
+        assert replies == [{"method": "ACK"}]
+
+    for i in range(200):
+        replies = deliver(nodes, lambda: random.choice(starts).get(f"key{i}", CLIENT))
+        assert replies == [{"method": "ACK", "args": i}]
+
+    ids = sorted(nodes)
+    owner = nodes[ids[bisect_left(ids, dht_hash("key7")) % len(ids)]]
+    assert owner.keystore["key7"] == 7
+
+    for method in ("PUT", "GET"):
+        hops = hop_counts(nodes, method)
+        assert len(hops) == 200
+        assert sum(hops) / len(hops) <= math.log2(100)
+
+
+def test_put_get_large_ring():
+    nodes = build_ring(20, 64)
+    starts = list(nodes.values())
+
+    for i in range(50):
+        assert deliver(nodes, lambda: random.choice(starts).put(f"key{i}", i, CLIENT)) == [{"method": "ACK"}]
+    for i in range(50):
+        assert deliver(nodes, lambda: random.choice(starts).get(f"key{i}", CLIENT)) == [{"method": "ACK", "args": i}]
+
+    ids = sorted(nodes)
+    owner = nodes[ids[bisect_left(ids, dht_hash("key7", maximum=2 ** 64)) % len(ids)]]
+    assert owner.keystore["key7"] == 7
+    assert max(ids) > 2 ** 32       # ids espalhados por todo o anel
+
+
+def test_put_get_many():
+    nodes = build_ring(30)
+    starts = list(nodes.values())
+    items = [(f"bulk{i}", i) for i in range(500)]
+
+    replies = deliver(nodes, lambda: starts[0].put_many(items, CLIENT))
+    assert sorted(key for reply in replies for key in reply["args"]["stored"]) == sorted(key for key, _ in items)
+    assert len(replies) <= len(nodes)       # uma resposta por nó dono
+
+    ids = sorted(nodes)
+    for key, value in items[:50]:
+        owner = nodes[ids[bisect_left(ids, dht_hash(key)) % len(ids)]]
+        assert owner.keystore[key] == value
+
+    replies = deliver(nodes, lambda: starts[1].put_many(items[:10] + [("bulk-new", 0)], CLIENT))
+    assert sorted(key for reply in replies for key in reply["args"]["exists"]) == sorted(key for key, _ in items[:10])
+    assert [key for reply in replies for key in reply["args"]["stored"]] == ["bulk-new"]
+
+    keys = [key for key, _ in items] + ["missing"]
+    replies = deliver(nodes, lambda: starts[2].get_many(keys, CLIENT))
+    assert dict(pair for reply in replies for pair in reply["args"]["items"]) == dict(items, missing=None)
+
+
+def test_batches_fit_in_datagrams():
+    nodes = build_ring(3)
+    big = "x" * 20000
+    items = [(f"big{i}", big) for i in range(30)]
+
+    deliver(nodes, lambda: next(iter(nodes.values())).put_many(items, CLIENT))
+    sent = []
+    for node in nodes.values():
+        node.send = lambda address, msg: sent.append(msg)
+        node.get_many([key for key, _ in items], CLIENT)
+
+    assert len(sent) > 3
+    assert all(len(pickle.dumps(msg)) <= MAX_DATAGRAM for msg in sent)
+
+
+def test_oversized_send_dropped():
+    node = DHTNode(("localhost", 7999))
+    node.send(("localhost", 9), {"method": "ACK", "args": {"items": [("big", "x" * MAX_DATAGRAM)]}})     # não rebenta
+    node.socket.close()
+
+
+def test_oversized_item_rejected():
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)      # um nó que nunca responde
+    silent.bind(("localhost", 0))
+    silent.settimeout(1)
+    client = DHTClient(silent.getsockname())
+    client.ring = [(0, silent.getsockname())]
+
+    assert not client.put_many({"huge": "x" * (MAX_DATAGRAM - 100), "small": 1}, timeout=0.1)
+    msg = pickle.loads(silent.recv(MAX_DATAGRAM))
+    assert msg["args"]["items"] == [("small", 1)]
+
+
+def test_nodes_timeout():
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("localhost", 0))
+    silent.settimeout(1)
+    client = DHTClient(silent.getsockname())
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        client.nodes(timeout=0.1, retries=2)
+    assert time.monotonic() - start >= 0.3
+    assert len([silent.recv(MAX_DATAGRAM) for _ in range(3)]) == 3      # uma vez por tentativa
+
+
+def test_rid_echoed():
+    nodes = build_ring(20)
+    starts = list(nodes.values())
+
+    for i in range(20):
+        assert deliver(nodes, lambda: random.choice(starts).put(f"rid{i}", i, CLIENT, rid=i)) == [{"method": "ACK", "rid": i}]
+    assert deliver(nodes, lambda: starts[0].put("rid3", 0, CLIENT, rid=99)) == [{"method": "NACK", "rid": 99}]
+    for i in range(20):
+        assert deliver(nodes, lambda: random.choice(starts).get(f"rid{i}", CLIENT, rid=i)) == [{"method": "ACK", "args": i, "rid": i}]
+
+
+def test_put_retried():
+    nodes = build_ring(20)
+    starts = list(nodes.values())
+
+    assert deliver(nodes, lambda: starts[0].put("retried", 1, CLIENT, rid=5)) == [{"method": "ACK", "rid": 5}]
+    # o ACK perdeu-se e o cliente repete o pedido (por outro nó, até)
+    assert deliver(nodes, lambda: starts[7].put("retried", 1, CLIENT, rid=5)) == [{"method": "ACK", "rid": 5}]
+    assert deliver(nodes, lambda: starts[3].put("retried", 2, CLIENT, rid=6)) == [{"method": "NACK", "rid": 6}]
+    assert deliver(nodes, lambda: starts[3].put("another", 3, CLIENT, rid=5)) == [{"method": "ACK", "rid": 5}]
+    assert sum(node.keystore.get("retried", 0) for node in starts) == 1
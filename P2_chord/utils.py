@@ -1,12 +1,10 @@
-def dht_hash(text, seed=0, maximum=2**10):
-    """ FNV-1a Hash Function. """
-    fnv_prime = 16777619
-    offset_basis = 2166136261
-    h = offset_basis + seed
-    for char in text:
-        h = h ^ ord(char)
-        h = h * fnv_prime
-    return h % maximum
+import pickle
+
+from hashing import dht_hash     # dht_hash passou para hashing.py, continua disponível aqui
+
+MAX_BITS = 160      # maior anel suportado: 2^160 ids (os bits do SHA-1)
+MAX_DATAGRAM = 65507    # maior payload de um datagrama UDP
+ROUTE_OVERHEAD = 512    # margem para o "from" e "hops" que os nós juntam a um lote que reencaminham
 
 
 def contains(begin, end, node):
@@ -20,3 +18,16 @@ def contains(begin, end, node):
             return True
             
     return False
+
+
+def split_batch(method, items, args=None, limit=MAX_DATAGRAM):
+    """Messages of method carrying items (in order) in args["items"], each one at most limit bytes once pickled.
+
+    An item too big on its own still gets its message (over the limit).
+    """
+
+    msg = {"method": method, "args": dict(args or {}, items=items)}
+    if len(items) > 1 and len(pickle.dumps(msg)) > limit:
+        half = len(items) // 2
+        return split_batch(method, items[:half], args, limit) + split_batch(method, items[half:], args, limit)
+    return [msg]